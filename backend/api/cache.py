@@ -0,0 +1,100 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def _version_key(namespace):
+    return f'api:{namespace}:version'
+
+
+def _now():
+    return int(time.time() * 1000000)
+
+
+def get_version(namespace):
+    """
+    Версия справочника: время последнего изменения (timestamp
+    в микросекундах). Ключи ответов включают версию, поэтому смена
+    версии делает все закэшированные ответы справочника недоступными.
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _now(), settings.REFERENCE_CACHE_TIMEOUT)
+        version = cache.get(key, _now())
+    return version
+
+
+def invalidate(namespace):
+    """
+    Сдвигает версию справочника к текущему времени и возвращает
+    (прежняя версия, новая). Сдвиг - атомарный incr, поэтому прежняя
+    версия - ровно та, которую он сменил, даже если версию
+    одновременно сдвигают другие процессы; None, если ее не было.
+    """
+    key = _version_key(namespace)
+    step = max(1, _now() - get_version(namespace))
+    try:
+        version = cache.incr(key, step)
+    except ValueError:
+        # Версия истекла между чтением и сдвигом.
+        version = _now()
+        cache.set(key, version, settings.REFERENCE_CACHE_TIMEOUT)
+        return None, version
+    cache.touch(key, settings.REFERENCE_CACHE_TIMEOUT)
+    return version - step, version
+
+
+class CachedResponseMixin:
+    """
+    Кэширует готовые JSON-байты list/retrieve и отдает их
+    с ETag и Last-Modified, отвечая 304 на условные запросы.
+    Сбрасывается через invalidate(cache_namespace), см. api.signals.
+    """
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        version = get_version(self.cache_namespace)
+        path = hashlib.md5(
+            request.get_full_path().encode()
+        ).hexdigest()
+        key = f'api:{self.cache_namespace}:{version}:{path}'
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = request.accepted_renderer.render(
+                response.data, request.accepted_media_type,
+                self.get_renderer_context()
+            )
+            etag = quote_etag(hashlib.md5(content).hexdigest())
+            entry = (content, etag)
+            cache.set(key, entry, settings.REFERENCE_CACHE_TIMEOUT)
+        content, etag = entry
+        last_modified = version // 1000000
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = HttpResponse(
+                content, content_type=request.accepted_renderer.media_type
+            )
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии индексов и ленты подписок хранятся в кэше: с кэшем процесса
+    воркеры не видят изменений друг друга.
+    """
+    if settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES:
+        return []
+    return [Warning(
+        'Кэш по умолчанию локален для процесса: индекс подбора рецептов '
+        'и ленты подписок в других воркерах устаревают до истечения '
+        'REFERENCE_CACHE_TIMEOUT и FEED_CACHE_TIMEOUT.',
+        hint='Укажите общий бэкенд в CACHE_BACKEND и CACHE_LOCATION.',
+        id='api.W001',
+    )]
@@ -0,0 +1,201 @@
+import heapq
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+from recipes.models import Recipe
+from users.models import Follow, User
+
+
+class FeedCache:
+    """
+    Лента рецептов авторов, на которых подписан пользователь.
+
+    В кэше у каждого пользователя хранятся id последних FEED_LENGTH
+    рецептов авторов, у которых не больше FEED_FANOUT_LIMIT подписчиков:
+    новый рецепт такого автора дописывается в ленты подписчиков
+    (push). Рецепты популярных авторов в ленты не пишутся, а читаются
+    при запросе страницы (fan_in) и сливаются с лентой. Лента
+    собирается из базы при первом запросе и сбрасывается при подписке,
+    отписке и переходе автора через FEED_FANOUT_LIMIT.
+
+    У ленты есть версия (атомарный incr при каждом изменении), лента
+    в кэше действительна, только пока ее версия совпадает с текущей.
+    Изменение переписывает ленту, только если она ровно предыдущей
+    версии: иначе параллельное изменение или сборка могли записать
+    ленту без него, и она соберется из базы заново.
+    """
+
+    def key(self, user_id):
+        return f'api:feed:{user_id}'
+
+    def version_key(self, user_id):
+        return f'api:feed:{user_id}:version'
+
+    def bump(self, user_ids):
+        """
+        Сдвигает версии лент и возвращает {user_id: новая версия}.
+        Ленты без версии пропускаются: их еще никто не собирал.
+        """
+        versions = {}
+        for user_id in user_ids:
+            try:
+                versions[user_id] = cache.incr(self.version_key(user_id))
+            except ValueError:
+                pass
+        return versions
+
+    def get_followers(self, author_id):
+        """Подписчики автора или None, если их больше FEED_FANOUT_LIMIT."""
+        limit = settings.FEED_FANOUT_LIMIT
+        followers = list(
+            Follow.objects.filter(author_id=author_id).values_list(
+                'user_id', flat=True
+            )[:limit + 1]
+        )
+        return None if len(followers) > limit else followers
+
+    def build(self, user_id):
+        authors = Follow.objects.filter(user_id=user_id).values_list(
+            'author_id', 'author__followers_count'
+        )
+        pushed, fan_in = [], []
+        for author_id, followers in authors:
+            if followers > settings.FEED_FANOUT_LIMIT:
+                fan_in.append(author_id)
+            else:
+                pushed.append(author_id)
+        recipes = list(
+            Recipe.objects.filter(author_id__in=pushed).order_by(
+                '-pk'
+            ).values_list('pk', flat=True)[:settings.FEED_LENGTH + 1]
+        )
+        return {
+            # По возрастанию: новые рецепты дописываются в конец,
+            # вытесняются самые старые.
+            'recipes': recipes[:settings.FEED_LENGTH][::-1],
+            'complete': len(recipes) <= settings.FEED_LENGTH,
+            'fan_in': fan_in,
+        }
+
+    def get(self, user_id):
+        key, version_key = self.key(user_id), self.version_key(user_id)
+        values = cache.get_many([key, version_key])
+        version = values.get(version_key)
+        if version is None:
+            # Время в микросекундах: не совпадет с версией старой ленты,
+            # если версия истекла раньше нее.
+            cache.add(
+                version_key, int(time.time() * 1000000),
+                settings.FEED_CACHE_TIMEOUT
+            )
+            version = cache.get(version_key)
+        entry = values.get(key)
+        if entry is None or entry['version'] != version:
+            # Версия прочитана до сборки: если лента изменится во время
+            # сборки, записанная лента будет уже недействительна.
+            entry = self.build(user_id)
+            entry['version'] = version
+            cache.set(key, entry, settings.FEED_CACHE_TIMEOUT)
+        return entry
+
+    def page(self, user_id, before=None, limit=6):
+        """
+        id рецептов страницы ленты (новые первыми) старше before
+        и признак, что есть следующая страница.
+        """
+        entry = self.get(user_id)
+        recipes = entry['recipes']
+        end = len(recipes) if before is None else bisect_left(
+            recipes, before
+        )
+        start = max(0, end - limit - 1)
+        sources = [recipes[start:end][::-1]]
+        if start == 0 and not entry['complete']:
+            # Страница дошла до вытесненной части ленты.
+            older = Recipe.objects.filter(
+                author__following__user_id=user_id
+            ).exclude(author_id__in=entry['fan_in'])
+            if recipes:
+                older = older.filter(pk__lt=recipes[0])
+            if before is not None:
+                older = older.filter(pk__lt=before)
+            sources.append(
+                older.order_by('-pk').values_list('pk', flat=True)[:limit + 1]
+            )
+        if entry['fan_in']:
+            fan_in = Recipe.objects.filter(author_id__in=entry['fan_in'])
+            if before is not None:
+                fan_in = fan_in.filter(pk__lt=before)
+            sources.append(
+                fan_in.order_by('-pk').values_list(
+                    'pk', flat=True
+                )[:limit + 1]
+            )
+        ids = []
+        for recipe_id in heapq.merge(*sources, reverse=True):
+            if not ids or ids[-1] != recipe_id:
+                ids.append(recipe_id)
+            if len(ids) > limit:
+                break
+        return ids[:limit], len(ids) > limit
+
+    def update_followers(self, author_id, change):
+        """Применяет change(entry) к закэшированным лентам подписчиков."""
+        followers = self.get_followers(author_id)
+        if not followers:
+            return
+        versions = self.bump(followers)
+        entries = cache.get_many(
+            [self.key(user_id) for user_id in versions]
+        )
+        changed = {}
+        for user_id, version in versions.items():
+            entry = entries.get(self.key(user_id))
+            if entry is None or entry['version'] != version - 1:
+                continue
+            change(entry)
+            entry['version'] = version
+            changed[self.key(user_id)] = entry
+        cache.set_many(changed, settings.FEED_CACHE_TIMEOUT)
+
+    def push(self, recipe_id, author_id):
+        def change(entry):
+            if recipe_id in entry['recipes']:
+                return
+            insort(entry['recipes'], recipe_id)
+            if len(entry['recipes']) > settings.FEED_LENGTH:
+                del entry['recipes'][0]
+                entry['complete'] = False
+
+        self.update_followers(author_id, change)
+
+    def remove(self, recipe_id, author_id):
+        def change(entry):
+            if recipe_id in entry['recipes']:
+                entry['recipes'].remove(recipe_id)
+
+        self.update_followers(author_id, change)
+
+    def follow_changed(self, user_id, author_id):
+        """
+        Сбрасывает ленту подписчика, а если автор перешел через
+        FEED_FANOUT_LIMIT - ленты всех его подписчиков.
+        """
+        user_ids = [user_id]
+        followers_count = User.objects.filter(pk=author_id).values_list(
+            'followers_count', flat=True
+        ).first()
+        if followers_count in (
+            settings.FEED_FANOUT_LIMIT, settings.FEED_FANOUT_LIMIT + 1
+        ):
+            user_ids.extend(
+                Follow.objects.filter(author_id=author_id).values_list(
+                    'user_id', flat=True
+                )
+            )
+        self.bump(user_ids)
+
+
+feed_cache = FeedCache()
@@ -0,0 +1,82 @@
+import base64
+import binascii
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_base64.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+# Кратно 4: каждый кусок base64 декодируется независимо.
+DECODE_CHUNK = 64 * 1024
+
+
+class StreamedBase64ImageField(Base64ImageField):
+    """
+    Base64ImageField, который декодирует data: URL кусками во временный
+    файл на диске, а не в память, и до полной проверки Pillow
+    отклоняет слишком большие картинки (validate_image_side).
+    """
+
+    def _decode(self, data):
+        if not (isinstance(data, str) and data.startswith('data:')):
+            return super()._decode(data)
+        header, separator, encoded = data.partition(';base64,')
+        if not separator:
+            raise serializers.ValidationError('Некорректная картинка')
+        content_type = header[len('data:'):]
+        extension = content_type.split('/')[-1]
+        os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+        file = TemporaryUploadedFile(
+            f'{uuid.uuid4()}.{extension}', content_type, 0, None
+        )
+        try:
+            for start in range(0, len(encoded), DECODE_CHUNK):
+                file.write(base64.b64decode(
+                    encoded[start:start + DECODE_CHUNK], validate=True
+                ))
+        except binascii.Error:
+            file.close()
+            raise serializers.ValidationError('Некорректная картинка')
+        file.size = file.tell()
+        file.seek(0)
+        try:
+            validate_image_side(file)
+        except serializers.ValidationError:
+            file.close()
+            raise
+        return file
+
+
+class UploadedImageField(serializers.ImageField):
+    """
+    ImageField для multipart-загрузки: сторона картинки проверяется
+    до полной проверки Pillow (размер файла - при приеме,
+    api.uploads.ImageUploadHandler).
+    """
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'seek'):
+            validate_image_side(data)
+        return super().to_internal_value(data)
+
+
+def validate_image_side(file):
+    """
+    Отклоняет картинки больше IMAGE_MAX_SIDE по ширине или высоте;
+    размеры читаются из заголовка файла.
+    """
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        raise serializers.ValidationError('Некорректная картинка')
+    finally:
+        file.seek(0)
+    if max(width, height) > settings.IMAGE_MAX_SIDE:
+        raise serializers.ValidationError(
+            f'Картинка больше {settings.IMAGE_MAX_SIDE} пикселей '
+            f'по стороне: {width}x{height}'
+        )
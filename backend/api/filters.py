@@ -1,6 +1,13 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (Case, Exists, F, FloatField, OuterRef, Q, Value,
+                              When)
 from django_filters import (BooleanFilter, CharFilter, FilterSet,
                             ModelMultipleChoiceFilter, NumberFilter)
-from recipes.models import Recipe, Tag
+from django_filters.widgets import BooleanWidget
+from recipes.models import IngredientsInRecipe, Recipe, Tag
+from rest_framework.filters import OrderingFilter
 
 
 class IngredientFilter(FilterSet):
@@ -8,32 +15,98 @@ class IngredientFilter(FilterSet):
 
 
 class RecipeFilter(FilterSet):
+    """
+    Все фильтры ленты рецептов. Теги, избранное и корзина проверяются
+    коррелированными EXISTS, поэтому выборке не нужен DISTINCT.
+    Флаги is_favorited и is_in_shopping_cart аннотирует
+    api.utils.get_recipe_queryset.
+    """
     author = NumberFilter(
-        field_name='author__id')
+        field_name='author_id')
     tags = ModelMultipleChoiceFilter(
         queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug'
+        to_field_name='slug',
+        method='get_tags'
     )
 
     is_favorited = BooleanFilter(
-        method='get_is_favorited'
+        method='get_is_favorited', widget=BooleanWidget()
     )
     is_in_shopping_cart = BooleanFilter(
-        method='get_is_in_shopping_cart'
+        method='get_is_in_shopping_cart', widget=BooleanWidget()
+    )
+    search = CharFilter(
+        method='get_search'
     )
 
-    def get_is_favorited(self, queryset, name, value):
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.annotate(
+            has_tags=Exists(Recipe.tags.through.objects.filter(
+                recipe_id=OuterRef('pk'), tag__in=value
+            ))
+        ).filter(has_tags=True)
 
-        if value:
-            return queryset.filter(favorite__user=self.request.user)
-        return queryset
+    def get_is_favorited(self, queryset, name, value):
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(is_favorited=True)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(shopping_cart__user=self.request.user)
-        return queryset
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(is_in_shopping_cart=True)
+
+    def get_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию, описанию и ингредиентам
+        с рангом search_rank. В PostgreSQL - по search_vector (GIN),
+        на других базах - icontains, совпадения в названии выше.
+        """
+        if connection.vendor == 'postgresql':
+            query = SearchQuery(value, config=settings.SEARCH_CONFIG)
+            return queryset.annotate(
+                search_rank=SearchRank(F('search_vector'), query)
+            ).filter(search_vector=query)
+        return queryset.annotate(
+            ingredient_match=Exists(IngredientsInRecipe.objects.filter(
+                recipe_id=OuterRef('pk'),
+                ingredient__name__icontains=value
+            )),
+            search_rank=Case(
+                When(name__icontains=value, then=Value(1.0)),
+                default=Value(0.5),
+                output_field=FloatField()
+            )
+        ).filter(
+            Q(name__icontains=value) | Q(text__icontains=value)
+            | Q(ingredient_match=True)
+        )
 
     class Meta():
         model = Recipe
-        fields = ('author', 'tags', 'is_in_shopping_cart', 'is_favorited')
+        fields = (
+            'author', 'tags', 'is_in_shopping_cart', 'is_favorited', 'search'
+        )
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    При ?search= по умолчанию сортирует по релевантности,
+    ?ordering=popular - по Recipe.popularity (refresh_popularity).
+    """
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get(self.ordering_param) == 'popular':
+            return ('-popularity', '-id')
+        return super().get_ordering(request, queryset, view)
+
+    def get_default_ordering(self, view):
+        if view.request.query_params.get('search'):
+            return ('-search_rank', '-id')
+        return super().get_default_ordering(view)
@@ -0,0 +1,212 @@
+import bisect
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.db import connection
+from recipes.models import Ingredient, IngredientsInRecipe
+
+from .cache import get_version, invalidate
+
+logger = logging.getLogger(__name__)
+
+
+class IngredientNameIndex:
+    """
+    Индекс имен ингредиентов в памяти процесса для автодополнения.
+    Загружается при первом запросе и перестраивается, когда меняется
+    версия справочника ингредиентов (api.cache.invalidate).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        # (ключи, элементы) публикуются одним присваиванием:
+        # search читает их без блокировки.
+        self._data = ([], [])
+
+    def _rebuild(self, version):
+        rows = sorted(
+            (name.lower(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit'
+            ).iterator()
+        )
+        keys = [row[0] for row in rows]
+        items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        ]
+        self._data = (keys, items)
+        self._version = version
+
+    def refresh(self):
+        version = get_version('ingredients')
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._rebuild(version)
+
+    def search(self, query, limit=None):
+        """
+        Сначала точное совпадение и совпадения по началу имени
+        (по алфавиту), затем совпадения внутри имени по позиции вхождения.
+        """
+        self.refresh()
+        keys, items = self._data
+        query = query.lower()
+        start = bisect.bisect_left(keys, query)
+        end = bisect.bisect_left(keys, query + '\uffff', lo=start)
+        found = items[start:end]
+        if limit is not None and len(found) >= limit:
+            return found[:limit]
+        substring = sorted(
+            (key.find(query), key, index)
+            for index, key in enumerate(keys)
+            if query in key and not key.startswith(query)
+        )
+        found += [items[index] for _, _, index in substring]
+        return found if limit is None else found[:limit]
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс ингредиент -> множество рецептов в памяти процесса
+    для подбора рецептов по имеющимся продуктам.
+    Изменения рецептов этого процесса применяются по одному рецепту,
+    изменения из других процессов - полной перестройкой
+    по версии 'recipes' (api.cache.invalidate).
+    Снимок (postings, recipes) не меняется на месте: изменения
+    копируют оба словаря и публикуют новый снимок одним присваиванием,
+    поэтому match читает индекс без блокировки.
+    Первый снимок процесса строится в запросе, следующие - в фоновом
+    потоке, а запросы тем временем читают предыдущий снимок.
+    Версия хранится в кэше Django, поэтому при нескольких процессах
+    нужен общий кэш (CACHE_BACKEND), иначе процесс не видит чужих
+    изменений до истечения REFERENCE_CACHE_TIMEOUT.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = None
+        self._rebuilding = False
+
+    def _load(self):
+        postings = defaultdict(set)
+        recipes = defaultdict(set)
+        rows = IngredientsInRecipe.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator(chunk_size=5000)
+        for recipe_id, ingredient_id in rows:
+            postings[ingredient_id].add(recipe_id)
+            recipes[recipe_id].add(ingredient_id)
+        return (
+            {key: frozenset(value) for key, value in postings.items()},
+            {key: frozenset(value) for key, value in recipes.items()},
+        )
+
+    def _rebuild_in_background(self, version):
+        try:
+            snapshot = self._load()
+            with self._lock:
+                self._snapshot = snapshot
+                self._version = version
+        except Exception:
+            logger.exception('Не удалось перестроить индекс рецептов')
+        finally:
+            self._rebuilding = False
+            # У потока свое соединение с базой.
+            connection.close()
+
+    def refresh(self, background=True):
+        """
+        Перестраивает индекс, если сменилась версия 'recipes':
+        в фоне, если снимок уже есть, иначе или при background=False -
+        сразу.
+        """
+        version = get_version('recipes')
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version or (
+                background and self._rebuilding
+            ):
+                return
+            if self._snapshot is None or not background:
+                self._snapshot = self._load()
+                self._version = version
+                return
+            self._rebuilding = True
+        threading.Thread(
+            target=self._rebuild_in_background, args=(version,),
+            name='recipe-index', daemon=True
+        ).start()
+
+    def _reindexed(self, recipe_id, ingredient_ids):
+        """Новый снимок, в котором у рецепта ингредиенты ingredient_ids."""
+        postings, recipes = self._snapshot
+        postings, recipes = dict(postings), dict(recipes)
+        for ingredient_id in recipes.pop(recipe_id, ()):
+            remaining = postings[ingredient_id] - {recipe_id}
+            if remaining:
+                postings[ingredient_id] = remaining
+            else:
+                del postings[ingredient_id]
+        for ingredient_id in ingredient_ids:
+            postings[ingredient_id] = postings.get(
+                ingredient_id, frozenset()
+            ) | {recipe_id}
+        if ingredient_ids:
+            recipes[recipe_id] = frozenset(ingredient_ids)
+        return postings, recipes
+
+    def update(self, recipe_id, deleted=False):
+        """
+        Переиндексирует один рецепт и сообщает другим процессам
+        о смене версии. Если индекс уже отстал от чужих изменений,
+        он будет перестроен целиком при следующем запросе.
+        """
+        with self._lock:
+            previous, version = invalidate('recipes')
+            if self._version is None or previous != self._version:
+                # Между версией индекса и этим изменением были чужие.
+                self._version = None
+                return
+            ingredient_ids = set() if deleted else set(
+                IngredientsInRecipe.objects.filter(
+                    recipe_id=recipe_id
+                ).values_list('ingredient_id', flat=True)
+            )
+            self._snapshot = self._reindexed(recipe_id, ingredient_ids)
+            self._version = version
+
+    def match(self, ingredient_ids, max_missing=None):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов:
+        список (recipe_id, matched, missing), сначала полностью
+        покрытые, затем по числу недостающих, при равенстве -
+        по числу совпавших и новизне.
+        """
+        self.refresh()
+        postings, recipes = self._snapshot
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        ranked = []
+        for recipe_id, count in matched.items():
+            ingredients = recipes.get(recipe_id)
+            if ingredients is None:
+                continue
+            missing = len(ingredients) - count
+            if max_missing is None or missing <= max_missing:
+                ranked.append((missing, -count, -recipe_id))
+        ranked.sort()
+        return [
+            (-recipe_id, -count, missing)
+            for missing, count, recipe_id in ranked
+        ]
+
+
+ingredient_index = IngredientNameIndex()
+recipe_index = RecipeIngredientIndex()
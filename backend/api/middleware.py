@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger('api.metrics')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1000, 10000, 100000, 1000000)
+
+
+class QueryCollector:
+    """
+    Обертка connection.execute_wrapper: считает запросы и время в базе.
+    Текст SQL без параметров, поэтому повторы N+1 схлопываются в один.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        total = 0
+        for bucket, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels},le="{bucket}"}} {total}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class RouteMetrics:
+    """
+    Гистограммы по маршрутам в памяти процесса: у каждого воркера
+    свои, Prometheus суммирует их по меткам instance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(lambda: {
+            'duration': Histogram(DURATION_BUCKETS),
+            'queries': Histogram(QUERY_BUCKETS),
+            'db': Histogram(DURATION_BUCKETS),
+            'render': Histogram(DURATION_BUCKETS),
+            'size': Histogram(SIZE_BUCKETS),
+        })
+
+    def observe(self, route, **values):
+        with self._lock:
+            histograms = self._routes[route]
+            for name, value in values.items():
+                if value is not None:
+                    histograms[name].observe(value)
+
+    def render(self):
+        names = {
+            'duration': 'foodgram_request_duration_seconds',
+            'queries': 'foodgram_request_queries',
+            'db': 'foodgram_request_db_seconds',
+            'render': 'foodgram_request_render_seconds',
+            'size': 'foodgram_response_size_bytes',
+        }
+        lines = []
+        with self._lock:
+            for key, name in names.items():
+                lines.append(f'# TYPE {name} histogram')
+                for (method, route), histograms in sorted(
+                    self._routes.items()
+                ):
+                    lines.extend(histograms[key].lines(
+                        name, f'method="{method}",route="{route}"'
+                    ))
+        return '\n'.join(lines) + '\n'
+
+
+route_metrics = RouteMetrics()
+
+
+class MetricsMiddleware:
+    """
+    Метрики запросов: число SQL-запросов, время в базе, время рендеринга
+    ответа (сериализация в JSON/CSV) и размер ответа. Отдает их в
+    заголовке Server-Timing, копит гистограммы по маршрутам для
+    metrics_view и пишет предупреждение с самыми частыми запросами,
+    если маршрут превысил QUERY_BUDGET.
+    Включается переменной окружения API_METRICS. Запросы, выполняемые
+    при потоковой отдаче ответа, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        if not settings.API_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        request.render_duration = None
+        collector = QueryCollector()
+        with connection.execute_wrapper(collector):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        route_metrics.observe(
+            (request.method, route),
+            duration=duration,
+            queries=collector.count,
+            db=collector.duration,
+            render=request.render_duration,
+            size=size
+        )
+        timings = [
+            f'db;dur={collector.duration * 1000:.1f};'
+            f'desc="{collector.count} queries"'
+        ]
+        if request.render_duration is not None:
+            timings.append(
+                f'render;dur={request.render_duration * 1000:.1f}'
+            )
+        timings.append(f'total;dur={duration * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+        if collector.count > settings.QUERY_BUDGET:
+            logger.warning(
+                '%s %s: %d SQL-запросов при бюджете %d, чаще всего:\n%s',
+                request.method, route, collector.count,
+                settings.QUERY_BUDGET,
+                '\n'.join(
+                    f'{count} x {sql}'
+                    for sql, count in collector.statements.most_common(5)
+                )
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_duration = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def metrics_view(request):
+    """Гистограммы в текстовом формате Prometheus."""
+    if not settings.API_METRICS:
+        raise Http404
+    return HttpResponse(
+        route_metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -1,6 +1,34 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class SubscriptionPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class PageOrCursorPagination(SubscriptionPagination):
+    """
+    Постраничная пагинация, по ?pagination=cursor - курсорная:
+    без COUNT(*) и OFFSET, страницы стабильны при добавлении записей.
+    Порядок курсора берется из OrderingFilter представления,
+    если он есть, иначе из ordering представления или cursor_ordering:
+    он должен совпадать с порядком постраничной пагинации.
+    """
+    cursor_ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = None
+        if request.query_params.get('pagination') != 'cursor':
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor = CursorPagination()
+        self.cursor.ordering = (
+            getattr(view, 'ordering', None) or self.cursor_ordering
+        )
+        self.cursor.page_size = self.page_size
+        self.cursor.page_size_query_param = self.page_size_query_param
+        return self.cursor.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
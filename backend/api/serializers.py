@@ -1,13 +1,18 @@
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer
 from drf_base64.fields import Base64ImageField
-from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes.images import variant_urls
+from recipes.models import (Favorite, ImageUpload, Ingredient,
+                            IngredientsInRecipe, Recipe, ShoppingCart, Tag)
 from rest_framework import serializers
 from rest_framework.relations import SlugRelatedField
 from rest_framework.validators import UniqueTogetherValidator
 from users.models import Follow, User
 
-from .utils import add_ingredients
+from .fields import StreamedBase64ImageField, UploadedImageField
+from .pagination import SubscriptionPagination
+from .utils import get_recipe_queryset, set_ingredients
 
 
 class GetIsSubscribedMixin:
@@ -19,6 +24,19 @@ class GetIsSubscribedMixin:
         return user.follower.filter(author=obj).exists()
 
 
+class ImageVariantsMixin:
+
+    def get_image_variants(self, obj):
+        urls = variant_urls(obj)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {
+            variant: request.build_absolute_uri(url)
+            for variant, url in urls.items()
+        }
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
 
     class Meta(UserCreateSerializer.Meta):
@@ -57,6 +75,8 @@ class CustomUserSerializer(GetIsSubscribedMixin,
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -107,29 +127,101 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = IngredientInRecipeSerializer(
         many=True
     )
-    image = Base64ImageField(
+    image = StreamedBase64ImageField(
         max_length=None,
-        use_url=True)
+        use_url=True,
+        required=False)
+    image_token = serializers.UUIDField(write_only=True, required=False)
+
+    def validate_image_token(self, token):
+        upload = ImageUpload.objects.filter(
+            token=token, user=self.context['request'].user
+        ).first()
+        if upload is None:
+            raise serializers.ValidationError('Загрузка не найдена')
+        return upload
+
+    def validate(self, attrs):
+        if 'image' in attrs and 'image_token' in attrs:
+            raise serializers.ValidationError(
+                'Укажите image или image_token, но не оба'
+            )
+        if self.instance is None and not (
+            'image' in attrs or 'image_token' in attrs
+        ):
+            raise serializers.ValidationError(
+                {'image': 'Обязательное поле (или image_token).'}
+            )
+        return attrs
+
+    def use_upload(self, validated_data):
+        """Картинка из загрузки уже в хранилище: рецепт берет ее имя."""
+        upload = validated_data.pop('image_token', None)
+        if upload is None:
+            return
+        deleted, _ = ImageUpload.objects.filter(pk=upload.pk).delete()
+        if not deleted:
+            raise serializers.ValidationError(
+                {'image_token': 'Загрузка уже использована'}
+            )
+        validated_data['image'] = upload.image.name
+
+    def validate_ingredients(self, ingredients):
+        ids = [str(item['ingredient']['id']) for item in ingredients]
+        known = {
+            str(pk) for pk in Ingredient.objects.filter(
+                pk__in=[pk for pk in ids if pk.isdigit()]
+            ).values_list('pk', flat=True)
+        }
+        errors = []
+        unknown = [pk for pk in dict.fromkeys(ids) if pk not in known]
+        if unknown:
+            errors.append(
+                f'Ингредиенты не найдены: {", ".join(unknown)}'
+            )
+        repeated = [pk for pk in dict.fromkeys(ids) if ids.count(pk) > 1]
+        if repeated:
+            errors.append(
+                f'Ингредиенты указаны повторно: {", ".join(repeated)}'
+            )
+        if errors:
+            raise serializers.ValidationError(errors)
+        return ingredients
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        self.use_upload(validated_data)
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
-        add_ingredients(ingredients, recipe)
+        set_ingredients(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        tags = validated_data.pop('tags')
-        instance.tags.set(tags)
-        ingredients = validated_data.pop('ingredients')
-        add_ingredients(ingredients, instance)
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            set_ingredients(instance, ingredients)
+        self.use_upload(validated_data)
         return super().update(instance, validated_data)
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Временный файл картинки уже перенесен в хранилище.
+            image = self.validated_data.get('image')
+            if isinstance(image, UploadedFile):
+                image.close()
+
     def to_representation(self, instance):
-        instance = GetRecipeSerializer(instance).data
-        return instance
+        request = self.context['request']
+        instance = get_recipe_queryset(request.user).get(pk=instance.pk)
+        return GetRecipeSerializer(instance, context=self.context).data
 
     class Meta:
         model = Recipe
@@ -137,6 +229,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'name',
             'author',
             'image',
+            'image_token',
             'text',
             'ingredients',
             'tags',
@@ -144,8 +237,19 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class GetRecipeSerializer(serializers.ModelSerializer):
+class ImageUploadSerializer(serializers.ModelSerializer):
+    image = UploadedImageField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ('token', 'image', 'created')
+        read_only_fields = ('token', 'created')
+
+
+class GetRecipeSerializer(ImageVariantsMixin,
+                          serializers.ModelSerializer):
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
     author = CustomUserSerializer(many=False)
@@ -159,29 +263,40 @@ class GetRecipeSerializer(serializers.ModelSerializer):
             'name',
             'author',
             'image',
+            'image_variants',
             'text',
             'ingredients',
             'tags',
             'cooking_time',
             'is_favorited',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'favorites_count'
         )
 
-    def is_object_exists(self, model, obj):
+    def is_object_exists(self, model, obj, annotation):
+        """
+        Берет флаг из аннотации выборки (RecipeViewSet.get_queryset),
+        запрос в базу делается только для неаннотированных объектов.
+        """
+        if hasattr(obj, annotation):
+            return getattr(obj, annotation)
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return model.objects.filter(user=request.user, recipe=obj).exists()
 
     def get_is_favorited(self, obj):
-        return self.is_object_exists(Favorite, obj)
+        return self.is_object_exists(Favorite, obj, 'is_favorited')
 
     def get_is_in_shopping_cart(self, obj):
-        return self.is_object_exists(ShoppingCart, obj)
+        return self.is_object_exists(
+            ShoppingCart, obj, 'is_in_shopping_cart'
+        )
 
     def get_ingredients(self, obj):
-        ings = IngredientsInRecipe.objects.filter(recipe=obj).all()
-        return IngredientInRecipeSerializer(ings, many=True).data
+        return IngredientInRecipeSerializer(
+            obj.ingredients_in_recipe.all(), many=True
+        ).data
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -208,48 +323,34 @@ class FollowSerializer(serializers.ModelSerializer):
         return instance
 
 
-class RecipeInFollowList(serializers.ModelSerializer):
+class RecipeInFollowList(ImageVariantsMixin,
+                         serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         fields = (
-            'id', 'name', 'image', 'cooking_time'
+            'id', 'name', 'image', 'image_variants', 'cooking_time'
         )
         model = Recipe
 
 
 class FollowListSerializer(serializers.ModelSerializer):
-    is_subscribed = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
-    recipes = serializers.SerializerMethodField()
+    """
+    Автор в списке подписок. Ожидает выборку из get_subscription_queryset.
+    """
+    is_subscribed = serializers.BooleanField(read_only=True)
+    recipes = RecipeInFollowList(
+        source='limited_recipes', many=True, read_only=True
+    )
 
     class Meta:
         fields = ('email', 'id', 'username',
                   'first_name', 'last_name',
                   'is_subscribed', 'recipes',
-                  'recipes_count'
+                  'recipes_count', 'followers_count'
                   )
         model = User
 
-    def get_recipes(self, user):
-
-        recipes = user.recipes.all()
-        recipes = recipes[0:3]
-        return RecipeInFollowList(
-            instance=recipes,
-            many=True,
-            context=self.context
-        ).data
-
-    def get_is_subscribed(self, obj):
-        return Follow.objects.filter(
-            author=obj
-        ).exists()
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(
-            author=obj
-        ).count()
-
 
 class ShopingCartSerializer(serializers.ModelSerializer):
 
@@ -272,20 +373,37 @@ class FavoriteSerializer(serializers.ModelSerializer):
         model = Favorite
 
 
-class RecipesParamsSerializer(serializers.Serializer):
-    is_favorited = serializers.ChoiceField(
-        required=False, choices=[0, 1]
-    )
-    is_in_shopping_cart = serializers.ChoiceField(
-        required=False, choices=[0, 1]
+class SubscriptionsParamsSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(
+        required=False, min_value=0, default=3
     )
-    author = serializers.PrimaryKeyRelatedField(
-        required=False,
-        queryset=User.objects.all()
+
+
+class IngredientSearchParamsSerializer(serializers.Serializer):
+    name = serializers.CharField(allow_blank=True, trim_whitespace=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+
+class FeedParamsSerializer(serializers.Serializer):
+    before = serializers.IntegerField(required=False, min_value=1)
+    limit = serializers.IntegerField(
+        required=False, min_value=1, max_value=100,
+        default=SubscriptionPagination.page_size
     )
-    tags = serializers.SlugRelatedField(
-        required=False,
-        many=True,
-        queryset=Tag.objects.all(),
-        slug_field='slug'
+
+
+class RecipeMatchParamsSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False
     )
+    max_missing = serializers.IntegerField(required=False, min_value=0)
+
+
+class RecipeMatchSerializer(GetRecipeSerializer):
+    matched_count = serializers.IntegerField(read_only=True)
+    missing_count = serializers.IntegerField(read_only=True)
+
+    class Meta(GetRecipeSerializer.Meta):
+        fields = GetRecipeSerializer.Meta.fields + (
+            'matched_count', 'missing_count'
+        )
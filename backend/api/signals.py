@@ -0,0 +1,64 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import Follow
+
+from .cache import invalidate
+from .feeds import feed_cache
+from .indexes import recipe_index
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    invalidate('tags')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    invalidate('ingredients')
+
+
+@receiver(post_delete, sender=Ingredient)
+def invalidate_recipe_index(sender, **kwargs):
+    # Удаление ингредиента каскадом меняет состав многих рецептов.
+    invalidate('recipes')
+
+
+@receiver(post_save, sender=Recipe)
+def reindex_recipe(sender, instance, **kwargs):
+    # Рецепт сохраняется до записи ингредиентов (API, inline в админке),
+    # поэтому индекс обновляется после фиксации транзакции.
+    transaction.on_commit(partial(recipe_index.update, instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(recipe_index.update, instance.pk, deleted=True)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def push_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            partial(feed_cache.push, instance.pk, instance.author_id)
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_feeds(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(feed_cache.remove, instance.pk, instance.author_id)
+    )
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def reset_feeds(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(feed_cache.follow_changed, instance.user_id,
+                instance.author_id)
+    )
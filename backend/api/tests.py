@@ -0,0 +1,555 @@
+import base64
+import difflib
+import os
+import re
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from recipes.models import (Favorite, ImageUpload, Ingredient,
+                            IngredientsInRecipe, Recipe, ShoppingCart, Tag)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Follow, User
+
+from .cache import get_version, invalidate
+from .feeds import feed_cache
+from .indexes import RecipeIngredientIndex, recipe_index
+
+# Картинка 1x1 PNG для создания рецепта через API.
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'tag{index}', color=f'#00000{index}',
+                slug=f'tag-{index}'
+            )
+            for index in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(3)
+        ]
+        for author_index in range(3):
+            author = User.objects.create(
+                username=f'author{author_index}',
+                email=f'author{author_index}@example.com',
+                first_name='Автор', last_name=str(author_index)
+            )
+            Follow.objects.create(user=cls.user, author=author)
+            for index in range(4):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Рецепт {author_index}-{index}',
+                    text='Описание', cooking_time=5, image=''
+                )
+                recipe.tags.set(tags)
+                IngredientsInRecipe.objects.bulk_create(
+                    IngredientsInRecipe(
+                        recipe=recipe, ingredient=ingredient, amount=10
+                    )
+                    for ingredient in ingredients
+                )
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response.json()['results']
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        small, small_results = self.count_queries('/api/recipes/?limit=2')
+        large, large_results = self.count_queries('/api/recipes/?limit=10')
+        self.assertEqual(len(small_results), 2)
+        self.assertEqual(len(large_results), 10)
+        self.assertTrue(all(
+            recipe['is_favorited'] and recipe['is_in_shopping_cart']
+            for recipe in large_results
+        ))
+        self.assertEqual(small, large)
+
+
+class SubscribeTest(TestCase):
+    """Подписка создается только после проверки параметров запроса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Проверка'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_invalid_params_do_not_create_follow(self):
+        response = self.client.post(
+            f'/api/users/{self.author.pk}/subscribe/?recipes_limit=abc'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_subscribe(self):
+        response = self.client.post(
+            f'/api/users/{self.author.pk}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Follow.objects.filter(
+            user=self.user, author=self.author
+        ).exists())
+
+
+class UserListPaginationTest(TestCase):
+    """Постраничная и курсорная пагинация отдают пользователей одинаково."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Порядок имен обратен порядку id.
+        for index in range(8):
+            User.objects.create(
+                username=f'user{9 - index}',
+                email=f'user{9 - index}@example.com',
+                first_name='Имя', last_name='Проверка'
+            )
+
+    def get_usernames(self, url):
+        usernames = []
+        while url:
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            usernames.extend(user['username'] for user in response.data[
+                'results'
+            ])
+            url = response.data['next']
+        return usernames
+
+    def test_same_order(self):
+        expected = sorted(
+            User.objects.values_list('username', flat=True)
+        )
+        self.assertEqual(self.get_usernames('/api/users/?limit=3'), expected)
+        self.assertEqual(
+            self.get_usernames('/api/users/?limit=3&pagination=cursor'),
+            expected
+        )
+
+
+class ImageUploadTest(TestCase):
+    """
+    Загрузка картинки через multipart: временный файл пишется вне
+    MEDIA_ROOT и переносится в хранилище, больший предела бросается.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings = override_settings(
+            MEDIA_ROOT=self.media_root, FILE_UPLOAD_TEMP_DIR=self.temp_dir,
+            IMAGE_UPLOAD_MAX_SIZE=1000
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content):
+        image = SimpleUploadedFile('image.png', content, 'image/png')
+        return self.client.post(
+            '/api/recipes/images/', {'image': image}, format='multipart'
+        )
+
+    def test_upload(self):
+        response = self.upload(base64.b64decode(IMAGE.split(',')[1]))
+        self.assertEqual(response.status_code, 201)
+        upload = ImageUpload.objects.get()
+        self.assertTrue(
+            upload.image.path.startswith(self.media_root)
+        )
+        self.assertTrue(os.path.isfile(upload.image.path))
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_too_large(self):
+        response = self.upload(b'x' * 1001)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertEqual(os.listdir(self.temp_dir), [])
+        self.assertEqual(os.listdir(self.media_root), [])
+
+
+class FeedCacheTest(TestCase):
+    """Изменения ленты во время сборки или другого изменения не теряются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Проверка'
+        )
+        Follow.objects.create(user=cls.viewer, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            author=self.author, name=f'Рецепт {Recipe.objects.count()}',
+            text='Описание', cooking_time=5, image=''
+        )
+
+    def assertFeed(self):
+        ids, _ = feed_cache.page(self.viewer.pk, limit=10)
+        self.assertEqual(ids, list(
+            Recipe.objects.order_by('-pk').values_list('pk', flat=True)
+        ))
+
+    def test_push_during_build(self):
+        self.create_recipe()
+        build = feed_cache.build
+
+        def build_then_push(user_id):
+            entry = build(user_id)
+            feed_cache.push(self.create_recipe().pk, self.author.pk)
+            return entry
+
+        with mock.patch.object(feed_cache, 'build', build_then_push):
+            feed_cache.page(self.viewer.pk)
+        self.assertFeed()
+
+    def test_concurrent_pushes(self):
+        feed_cache.page(self.viewer.pk)
+        first, second = self.create_recipe(), self.create_recipe()
+        get_many = cache.get_many
+        pushed = []
+
+        def get_many_then_push(keys):
+            values = get_many(keys)
+            if not pushed:
+                pushed.append(second.pk)
+                feed_cache.push(second.pk, self.author.pk)
+            return values
+
+        with mock.patch(
+            'api.feeds.cache.get_many', side_effect=get_many_then_push
+        ):
+            feed_cache.push(first.pk, self.author.pk)
+        self.assertFeed()
+
+
+class RecipeIngredientIndexTest(TestCase):
+    """Индекс подбора не пропускает чужие изменения при своих."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Проверка'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            cooking_time=5, image=''
+        )
+        IngredientsInRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=1
+        )
+
+    def setUp(self):
+        self.index = RecipeIngredientIndex()
+        self.index.refresh(background=False)
+
+    def test_update(self):
+        self.index.update(self.recipe.pk)
+        self.assertEqual(self.index._version, get_version('recipes'))
+        self.assertEqual(
+            self.index.match([self.ingredient.pk]), [(self.recipe.pk, 1, 0)]
+        )
+
+    def test_update_after_foreign_change(self):
+        invalidate('recipes')
+        self.index.update(self.recipe.pk)
+        self.assertIsNone(self.index._version)
+
+    def test_foreign_change_during_update(self):
+        def invalidate_twice(namespace):
+            versions = invalidate(namespace)
+            invalidate(namespace)
+            return versions
+
+        with mock.patch('api.indexes.invalidate', invalidate_twice):
+            self.index.update(self.recipe.pk)
+        self.assertNotEqual(self.index._version, get_version('recipes'))
+
+
+# (название, метод, адрес, тело запроса). В адресе и теле подставляются
+# {author}, {target_author}, {recipe}, {target_recipe}, {created},
+# {ingredient}, {tag}, {tag_id}, {size}.
+# Общие списки на малом размере уже отдают полную страницу, поэтому рост
+# строк ловят списки, ограниченные данными теста (автор, подписки,
+# избранное, покупки).
+ROUTES = (
+    ('users', 'get', '/api/users/', None),
+    ('users_detail', 'get', '/api/users/{author}/', None),
+    ('users_me', 'get', '/api/users/me/', None),
+    ('subscriptions', 'get', '/api/users/subscriptions/?limit=50', None),
+    ('recipes', 'get', '/api/recipes/', None),
+    ('recipes_cursor', 'get', '/api/recipes/?pagination=cursor', None),
+    ('recipes_author', 'get',
+     '/api/recipes/?author={author}&limit=50', None),
+    ('recipes_tags', 'get', '/api/recipes/?tags={tag}', None),
+    ('recipes_popular', 'get', '/api/recipes/?ordering=popular', None),
+    ('recipes_favorited', 'get',
+     '/api/recipes/?is_favorited=1&limit=50', None),
+    ('recipes_in_cart', 'get',
+     '/api/recipes/?is_in_shopping_cart=1&limit=50', None),
+    ('recipes_search', 'get', '/api/recipes/?search=Проверка', None),
+    ('recipes_match', 'get',
+     '/api/recipes/match/?ingredients={ingredient}', None),
+    ('recipes_feed', 'get', '/api/recipes/feed/?limit=50', None),
+    ('recipes_detail', 'get', '/api/recipes/{recipe}/', None),
+    ('download_shopping_cart', 'get',
+     '/api/recipes/download_shopping_cart/', None),
+    ('tags', 'get', '/api/tags/', None),
+    ('tags_detail', 'get', '/api/tags/{tag_id}/', None),
+    ('ingredients', 'get', '/api/ingredients/', None),
+    ('ingredients_search', 'get', '/api/ingredients/?name=Провер', None),
+    ('subscribe', 'post', '/api/users/{target_author}/subscribe/', None),
+    ('unsubscribe', 'delete', '/api/users/{target_author}/subscribe/', None),
+    ('favorite', 'post', '/api/recipes/{target_recipe}/favorite/', None),
+    ('unfavorite', 'delete', '/api/recipes/{target_recipe}/favorite/', None),
+    ('shopping_cart', 'post',
+     '/api/recipes/{target_recipe}/shopping_cart/', None),
+    ('shopping_cart_remove', 'delete',
+     '/api/recipes/{target_recipe}/shopping_cart/', None),
+    ('recipe_create', 'post', '/api/recipes/', {
+        'name': 'Проверка бюджета {size}',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': IMAGE,
+        'tags': ['{tag_id}'],
+        'ingredients': [{'id': '{ingredient}', 'amount': 5}],
+    }),
+    ('recipe_update', 'patch', '/api/recipes/{created}/', {
+        'ingredients': [{'id': '{ingredient}', 'amount': 7}],
+    }),
+    ('recipe_delete', 'delete', '/api/recipes/{created}/', None),
+)
+
+NORMALIZE = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+\b'), '?'),
+    (re.compile(r'\(\?(?:, \?)*\)'), '(...)'),
+)
+
+
+def normalize(sql):
+    """SQL без значений параметров: запросы разных размеров сравнимы."""
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def fill(value, context):
+    if isinstance(value, str):
+        value = value.format(**context)
+        return int(value) if value.isdigit() else value
+    if isinstance(value, list):
+        return [fill(item, context) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    return value
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Число SQL-запросов маршрутов API не растет вместе с объемом данных:
+    каждый маршрут вызывается на SMALL авторах по SMALL рецептов и на
+    LARGE по LARGE.
+    """
+
+    SMALL, LARGE = 2, 5
+
+    @classmethod
+    def setUpClass(cls):
+        # Картинка созданного рецепта не должна остаться в MEDIA_ROOT.
+        cls.media = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        cls.media.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media.options['MEDIA_ROOT'], ignore_errors=True)
+        cls.media.disable()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(
+            username='budget-viewer', email='budget-viewer@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        target = User.objects.create(
+            username='budget-target', email='budget-target@example.com',
+            first_name='Автор', last_name='Проверка'
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'budget{index}', color=f'#0000F{index}',
+                slug=f'budget-{index}'
+            )
+            for index in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Проверка {index}', measurement_unit='г'
+            )
+            for index in range(3)
+        ]
+        target_recipe = Recipe.objects.create(
+            author=target, name='Проверка чужой', text='Описание',
+            cooking_time=5, image=''
+        )
+        IngredientsInRecipe.objects.create(
+            recipe=target_recipe, ingredient=cls.ingredients[0], amount=1
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.context = {
+            'target_author': target.pk,
+            'target_recipe': target_recipe.pk,
+            'tag': cls.tags[0].slug,
+            'tag_id': cls.tags[0].pk,
+            'ingredient': cls.ingredients[0].pk,
+        }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.context = dict(self.context)
+
+    def seed(self, size):
+        """Доводит данные до size авторов по size рецептов."""
+        for index in range(size):
+            author, created = User.objects.get_or_create(
+                username=f'budget-author-{index}',
+                defaults={
+                    'email': f'budget-author-{index}@example.com',
+                    'first_name': 'Автор', 'last_name': str(index),
+                }
+            )
+            if created:
+                Follow.objects.create(user=self.viewer, author=author)
+            for number in range(author.recipes.count(), size):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Проверка {index}-{number}',
+                    text='Описание', cooking_time=5, image=''
+                )
+                recipe.tags.set(self.tags)
+                IngredientsInRecipe.objects.bulk_create(
+                    IngredientsInRecipe(
+                        recipe=recipe, ingredient=ingredient, amount=10
+                    )
+                    for ingredient in self.ingredients
+                )
+                Favorite.objects.create(user=self.viewer, recipe=recipe)
+                ShoppingCart.objects.create(user=self.viewer, recipe=recipe)
+        self.context['author'] = User.objects.get(
+            username='budget-author-0'
+        ).pk
+        self.context['recipe'] = Recipe.objects.filter(
+            author_id=self.context['author']
+        ).latest('pk').pk
+
+    def measure(self, size):
+        """{маршрут: (статус, [SQL])} для текущего объема данных."""
+        self.seed(size)
+        self.context['size'] = size
+        results = {}
+        for name, method, url, data in ROUTES:
+            for namespace in ('tags', 'ingredients', 'recipes'):
+                invalidate(namespace)
+            # Лента собирается заново: on_commit в транзакции теста
+            # не срабатывает.
+            cache.delete(feed_cache.key(self.viewer.pk))
+            # Индекс подбора перестраивается в фоне; здесь - сразу,
+            # чтобы запрос видел текущие данные.
+            recipe_index.refresh(background=False)
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(
+                    fill(url, self.context), fill(data, self.context),
+                    format='json'
+                )
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            if name == 'recipe_create' and response.status_code == 201:
+                self.context['created'] = response.json()['id']
+            results[name] = (
+                response.status_code,
+                [query['sql'] for query in queries.captured_queries]
+            )
+        return results
+
+    def test_queries_do_not_grow_with_data(self):
+        before = self.measure(self.SMALL)
+        after = self.measure(self.LARGE)
+        for name, _, _, _ in ROUTES:
+            (status_small, small_sql), (status_large, large_sql) = (
+                before[name], after[name]
+            )
+            with self.subTest(route=name):
+                self.assertLess(status_small, 400)
+                self.assertLess(status_large, 400)
+                self.assertLessEqual(
+                    len(large_sql), len(small_sql), '\n'.join(
+                        difflib.unified_diff(
+                            [normalize(sql) for sql in small_sql],
+                            [normalize(sql) for sql in large_sql],
+                            f'{name} size={self.SMALL}',
+                            f'{name} size={self.LARGE}', lineterm=''
+                        )
+                    )
+                )
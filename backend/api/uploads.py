@@ -0,0 +1,32 @@
+import os
+
+from django.conf import settings
+from django.core.files.uploadhandler import (SkipFile,
+                                             TemporaryFileUploadHandler)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Пишет файл кусками на диск в FILE_UPLOAD_TEMP_DIR при любом размере,
+    не в память. Файл больше max_size бросается на первом лишнем куске,
+    остаток на диск не пишется; имена его полей - в skipped.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.skipped = []
+
+    def new_file(self, *args, **kwargs):
+        os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.max_size is not None and (
+            start + len(raw_data) > self.max_size
+        ):
+            # Закрытый временный файл удаляется.
+            self.file.close()
+            self.skipped.append(self.field_name)
+            raise SkipFile
+        return super().receive_data_chunk(raw_data, start)
@@ -2,8 +2,8 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (FavoriteViewSet, FollowListViewSet, FollowViewSet,
-                    IngredientViewSet, RecipeViewSet, ShoppingCartViewSet,
-                    TagViewSet, UserViewSet)
+                    ImageUploadView, IngredientViewSet, RecipeViewSet,
+                    ShoppingCartViewSet, TagViewSet, UserViewSet)
 
 router = DefaultRouter()
 
@@ -15,6 +15,10 @@ router.register('recipes', RecipeViewSet)
 router.register('users', FollowViewSet, basename='subscribe')
 
 urlpatterns = [
+     path(
+          'recipes/images/',
+          ImageUploadView.as_view(),
+          name='recipe_image_upload'),
      path(
           'recipes/<int:recipe_id>/favorite/',
           FavoriteViewSet.as_view(),
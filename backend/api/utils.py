@@ -1,15 +1,98 @@
-from django.shortcuts import get_object_or_404
-from recipes.models import Ingredient, IngredientsInRecipe
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
+from recipes.models import (Favorite, IngredientsInRecipe, Recipe,
+                            ShoppingCart)
+from recipes.utils import (apply_cart_delta, get_cart_users,
+                           get_recipe_amounts, update_search_vectors)
+from users.models import Follow, User
 
 
-def add_ingredients(ingredients, obj):
-    for ingredient in ingredients:
-        c_ing = get_object_or_404(
-            Ingredient, pk=ingredient['ingredient']['id']
+def set_ingredients(recipe, ingredients):
+    """
+    Заменяет список ингредиентов рецепта одним delete и одним bulk_create
+    и переносит разницу в списки покупок, где есть этот рецепт.
+    Ингредиенты должны быть проверены заранее (validate_ingredients).
+    """
+    old_amounts = get_recipe_amounts([recipe.pk])
+    recipe.ingredients_in_recipe.all().delete()
+    rows = IngredientsInRecipe.objects.bulk_create(
+        IngredientsInRecipe(
+            recipe=recipe,
+            ingredient_id=int(item['ingredient']['id']),
+            amount=item['amount']
         )
-        ing_rec, status = IngredientsInRecipe.objects.get_or_create(
-            amount=ingredient['amount'],
-            ingredient=c_ing
+        for item in ingredients
+    )
+    delta = {pk: -amount for pk, amount in old_amounts.items()}
+    for row in rows:
+        delta[row.ingredient_id] = delta.get(row.ingredient_id, 0) + row.amount
+    apply_cart_delta(get_cart_users(recipe.pk), delta)
+    update_search_vectors(Recipe.objects.filter(pk=recipe.pk))
+    return recipe
+
+
+def annotate_is_subscribed(queryset, user):
+    """Добавляет к выборке авторов флаг подписки пользователя user."""
+    if not user.is_authenticated:
+        return queryset.annotate(
+            is_subscribed=Value(False, output_field=BooleanField())
+        )
+    return queryset.annotate(
+        is_subscribed=Exists(Follow.objects.filter(
+            user=user, author=OuterRef('pk')
+        ))
+    )
+
+
+def get_recipe_queryset(user, queryset=None):
+    """
+    Выборка рецептов со всем, что нужно GetRecipeSerializer:
+    флаги избранного и корзины, автор с флагом подписки,
+    теги и ингредиенты загружаются фиксированным числом запросов.
+    """
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    if user.is_authenticated:
+        queryset = queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
         )
-        obj.ingredients.add(ing_rec.id)
-    return obj
+    else:
+        queryset = queryset.annotate(
+            is_favorited=Value(False, output_field=BooleanField()),
+            is_in_shopping_cart=Value(False, output_field=BooleanField())
+        )
+    return queryset.defer('search_vector').prefetch_related(
+        Prefetch(
+            'author',
+            queryset=annotate_is_subscribed(User.objects.all(), user)
+        ),
+        'tags',
+        Prefetch(
+            'ingredients_in_recipe',
+            queryset=IngredientsInRecipe.objects.select_related('ingredient')
+        )
+    )
+
+
+def get_subscription_queryset(user, queryset, recipes_limit=None):
+    """
+    Выборка авторов для FollowListSerializer: флаг подписки считается
+    в том же запросе (число рецептов - счетчик User.recipes_count),
+    последние recipes_limit рецептов каждого автора загружаются одним
+    дополнительным запросом.
+    """
+    recipes = Recipe.objects.order_by('-id')
+    if recipes_limit is not None:
+        recipes = recipes.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).order_by('-id').values('pk')[:recipes_limit]
+        ))
+    return annotate_is_subscribed(queryset, user).prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+    )
@@ -1,31 +1,50 @@
 import djoser
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Sum
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
-                            ShoppingCart, Tag)
-from rest_framework import generics, status, viewsets, filters
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from users.models import Follow, User
 
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import SubscriptionPagination
+from .cache import CachedResponseMixin
+from .feeds import feed_cache
+from .filters import IngredientFilter, RecipeFilter, RecipeOrderingFilter
+from .indexes import ingredient_index, recipe_index
+from .pagination import PageOrCursorPagination, SubscriptionPagination
 from .permissions import IsOwnerOrReadOnly
+from .renderers import (CSVShoppingListRenderer, JSONShoppingListRenderer,
+                        TextShoppingListRenderer)
 from .serializers import (CustomUserCreateSerializer, CustomUserSerializer,
-                          FollowListSerializer, FollowSerializer,
-                          GetRecipeSerializer, IngredientSerializer,
-                          RecipeSerializer, RecipesParamsSerializer,
-                          ShopingCartCreateSerializer, TagSerializer)
+                          FeedParamsSerializer, FollowListSerializer,
+                          FollowSerializer, GetRecipeSerializer,
+                          ImageUploadSerializer,
+                          IngredientSearchParamsSerializer,
+                          IngredientSerializer, RecipeMatchParamsSerializer,
+                          RecipeMatchSerializer, RecipeSerializer,
+                          ShopingCartCreateSerializer,
+                          SubscriptionsParamsSerializer, TagSerializer)
+from .uploads import ImageUploadHandler
+from .utils import (annotate_is_subscribed, get_recipe_queryset,
+                    get_subscription_queryset)
 
 
 class UserViewSet(UserViewSet):
     queryset = User.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    pagination_class = PageOrCursorPagination
+    ordering = ('username',)
 
     def get_serializer_class(self):
         if self.action == "set_password":
@@ -35,15 +54,19 @@ class UserViewSet(UserViewSet):
         else:
             return CustomUserSerializer
 
-    def list(self, request):
-        queryset = User.objects.all()
-        serializer = CustomUserSerializer(queryset, many=True)
-        return Response(serializer.data)
+    def get_queryset(self):
+        """
+        Все пользователи с флагом подписки текущего пользователя
+        в порядке ordering: он же порядок курсора при ?pagination=cursor.
+        """
+        # Фильтр HIDE_USERS из djoser не нужен: список пользователей открыт.
+        return annotate_is_subscribed(
+            User.objects.order_by(*self.ordering), self.request.user
+        )
 
 
 class FollowViewSet(UserViewSet):
     queryset = User.objects.all()
-    pagination_class = SubscriptionPagination
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
     def get_serializer_class(self):
@@ -62,9 +85,16 @@ class FollowViewSet(UserViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         if request.method == 'POST':
+            params = SubscriptionsParamsSerializer(data=request.query_params)
+            params.is_valid(raise_exception=True)
             Follow.objects.create(user=user, author=author)
-            queryset = User.objects.get(pk=id)
-            serializer = self.get_serializer_class()(queryset, many=False)
+            author = get_subscription_queryset(
+                user, User.objects.filter(pk=author.pk),
+                params.validated_data['recipes_limit']
+            ).get()
+            serializer = FollowListSerializer(
+                author, context=self.get_serializer_context()
+            )
             return Response(serializer.data)
         else:
             if Follow.objects.filter(user=user, author=author).exists():
@@ -80,13 +110,22 @@ class FollowListViewSet(UserViewSet):
     queryset = User.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = FollowListSerializer
-    pagination_class = SubscriptionPagination
 
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False, methods=['get'], permission_classes=(IsAuthenticated,)
+    )
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=self.request.user).all()
+        params = SubscriptionsParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = get_subscription_queryset(
+            request.user,
+            User.objects.filter(following__user=request.user),
+            params.validated_data['recipes_limit']
+        )
         page = self.paginate_queryset(queryset)
-        serializer = FollowListSerializer(page, many=True)
+        serializer = FollowListSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
         return self.get_paginated_response(serializer.data)
 
 
@@ -94,10 +133,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = [IsOwnerOrReadOnly]
     filter_backends = (DjangoFilterBackend,
-                       filters.OrderingFilter)
+                       RecipeOrderingFilter)
     filterset_class = RecipeFilter
-    ordering = ('-id')
-    pagination_class = SubscriptionPagination
+    ordering = ('-id',)
+    pagination_class = PageOrCursorPagination
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -109,79 +148,142 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeSerializer
 
     def retrieve(self, request, pk=None):
-        queryset = Recipe.objects.all()
+        queryset = self.get_queryset()
         recipe = get_object_or_404(queryset, pk=pk)
         serializer = GetRecipeSerializer(recipe, context={'request': request})
         return Response(serializer.data)
 
-    def get_serializer_context(self):
-        """Возвращает контекст сериализатора."""
-        context = super().get_serializer_context()
-        query = RecipesParamsSerializer(data=self.request.query_params)
-        query.is_valid(raise_exception=True)
-        query_params = query.validated_data
-        context['is_favorited'] = query_params.get(
-            'is_favorited'
-        )
-        context['is_in_shopping_cart'] = query_params.get(
-            'is_in_shopping_cart'
-        )
-        author = query_params.get('author')
-        context['author'] = author.pk if author else None
-        tags_slug = query_params.get('tags')
-        context['tags'] = (
-            [slug.pk for slug in tags_slug] if tags_slug else None
-        )
-        return context
-
     def send_message(self, ingredients):
-        shopping_list = ''
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n{ingredient['ingredient__name']} "
-                f"{ingredient['ingredient__measurement_unit']} "
-                f"{ingredient['amount']}"
-            )
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        renderer = self.request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.render_rows(ingredients.iterator(chunk_size=500)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        file = f'shopping_list.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename="{file}"'
         return response
 
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False, methods=['get'],
+        renderer_classes=(TextShoppingListRenderer, CSVShoppingListRenderer,
+                          JSONShoppingListRenderer)
+    )
     def download_shopping_cart(self, request):
-        ings = IngredientsInRecipe.objects.select_related(
-            'recipe', 'ingredient'
-        )
+        """
+        Список покупок, агрегированный в базе по (name, measurement_unit).
+        Формат выбирается параметром ?format=txt|csv|json.
+        """
         if request.user.is_authenticated:
-            ings = ings.filter(
-                recipe__shopping_cart__user=request.user
-            ).order_by("ingredient__name")
+            ings = ShoppingCartIngredient.objects.filter(user=request.user)
         else:
-            ings = ings.filter(
-                recipe_id__in=request.session['purchases']
+            ings = IngredientsInRecipe.objects.filter(
+                recipe_id__in=request.session.get('purchases', [])
             )
-        ingredients = ings.values(
+        ingredients = ings.values_list(
             'ingredient__name', 'ingredient__measurement_unit'
         ).annotate(
             amount=Sum('amount')
-        )
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
         return self.send_message(ingredients)
 
+    @action(
+        detail=False, methods=['get'],
+        pagination_class=SubscriptionPagination
+    )
+    def match(self, request):
+        """
+        Подбор рецептов по имеющимся ингредиентам
+        (?ingredients=1&ingredients=2[&max_missing=N]).
+        Ранжирует обратный индекс в памяти, из базы читается
+        только текущая страница.
+        """
+        params = RecipeMatchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        rows = recipe_index.match(
+            params.validated_data['ingredients'],
+            params.validated_data.get('max_missing')
+        )
+        page = self.paginate_queryset(rows)
+        recipes = get_recipe_queryset(request.user).in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        results = []
+        for recipe_id, matched, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.matched_count = matched
+                recipe.missing_count = missing
+                results.append(recipe)
+        serializer = RecipeMatchSerializer(
+            results, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False, methods=['get'], permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        """
+        Рецепты авторов из подписок, новые первыми
+        (?limit=N[&before=id]). Страница берется из ленты в кэше
+        (api.feeds), из базы читаются только ее рецепты.
+        """
+        params = FeedParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        ids, has_next = feed_cache.page(
+            request.user.pk,
+            params.validated_data.get('before'),
+            params.validated_data['limit']
+        )
+        recipes = get_recipe_queryset(request.user).in_bulk(ids)
+        serializer = GetRecipeSerializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True,
+            context=self.get_serializer_context()
+        )
+        next_url = None
+        if has_next:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'before', ids[-1]
+            )
+        return Response({'next': next_url, 'results': serializer.data})
+
     def get_queryset(self):
-        """Возвращает выборку данных по рецептам."""
-        queryset = super().get_queryset()
-        context = self.get_serializer_context()
-        user = self.request.user
-        if context['is_favorited']:
-            queryset = queryset.filter(favorite__user=user)
-        if context['is_in_shopping_cart']:
-            queryset = queryset.filter(shopping_cart__user=user)
-        if context['author']:
-            queryset = queryset.filter(author__id=context['author'])
-        if context['tags']:
-            queryset = queryset.filter(tags__id__in=context['tags']).distinct()
+        """
+        Возвращает выборку данных по рецептам.
+        Параметры запроса разбирает и применяет RecipeFilter.
+        """
+        return get_recipe_queryset(self.request.user, super().get_queryset())
 
-        return queryset
+
+class ImageUploadView(generics.CreateAPIView):
+    """
+    Загрузка картинки рецепта через multipart. Файл пишется кусками
+    на диск (ImageUploadHandler), в ответе - токен для image_token
+    при создании и изменении рецепта.
+    """
+
+    serializer_class = ImageUploadSerializer
+    permission_classes = (IsAuthenticated, )
+    parser_classes = (MultiPartParser, )
+
+    def initialize_request(self, request, *args, **kwargs):
+        self.upload_handler = ImageUploadHandler(
+            request, settings.IMAGE_UPLOAD_MAX_SIZE
+        )
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        # Multipart разбирается при первом обращении к request.data.
+        if request.data is not None and self.upload_handler.skipped:
+            raise ValidationError({
+                field: f'Файл больше {settings.IMAGE_UPLOAD_MAX_SIZE} байт'
+                for field in self.upload_handler.skipped
+            })
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
 
 
 class FavoriteViewSet(
@@ -228,27 +330,47 @@ class ShoppingCartViewSet(
     def create(self, request, *args, **kwargs):
         recipe_id = self.kwargs.get('recipe_id')
         recipe = get_object_or_404(Recipe, pk=recipe_id)
-        ShoppingCart.objects.create(user=self.request.user, recipe=recipe)
+        # Строка корзины и агрегированный список покупок
+        # (recipes.signals) фиксируются вместе.
+        with transaction.atomic():
+            ShoppingCart.objects.create(user=self.request.user, recipe=recipe)
         serializer = ShopingCartCreateSerializer(recipe, many=False)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, *args, **kwargs):
         recipe_id = self.kwargs.get('recipe_id')
         recipe = get_object_or_404(Recipe, pk=recipe_id)
-        ShoppingCart.objects.filter(
-            user=self.request.user, recipe=recipe
-        ).delete()
+        with transaction.atomic():
+            ShoppingCart.objects.filter(
+                user=self.request.user, recipe=recipe
+            ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        if 'name' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.search, request, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        """Автодополнение по индексу в памяти, без запроса к базе."""
+        params = IngredientSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(ingredient_index.search(
+            params.validated_data['name'],
+            params.validated_data.get('limit')
+        ))
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
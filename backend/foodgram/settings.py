@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -41,7 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'users.apps.UsersConfig',
     'recipes.apps.RecipesConfig',
-    'api',
+    'api.apps.ApiConfig',
     'rest_framework',
     'django_filters',
     'rest_framework.authtoken',
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,6 +97,67 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# LocMemCache подходит только для одного процесса. В кэше лежат версии
+# справочников и индекса рецептов (api.cache), ленты подписок
+# (api.feeds), поэтому при нескольких воркерах gunicorn нужен общий
+# бэкенд, например CACHE_BACKEND=django.core.cache.backends.memcached.
+# MemcachedCache; manage.py check --deploy предупреждает об этом.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+# Время жизни кэша справочников (теги, ингредиенты), секунды.
+# Локальный кэш у каждого процесса свой, поэтому без общего бэкенда
+# изменения в другом процессе видны не позже чем через это время.
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 300))
+
+
+# Конфигурация полнотекстового поиска рецептов (PostgreSQL).
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+
+
+# Метрики запросов (api.middleware.MetricsMiddleware): Server-Timing
+# и гистограммы по маршрутам на /metrics/. QUERY_BUDGET - число
+# SQL-запросов на запрос, сверх которого пишется предупреждение.
+API_METRICS = os.getenv('API_METRICS', 'False') == 'True'
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 20))
+
+
+# Лента рецептов подписок (api.feeds.FeedCache): длина ленты в кэше,
+# число подписчиков, сверх которого рецепты автора не дописываются
+# в ленты, а читаются при запросе, и время жизни ленты в кэше, секунды.
+FEED_LENGTH = int(os.getenv('FEED_LENGTH', 500))
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+FEED_CACHE_TIMEOUT = int(os.getenv('FEED_CACHE_TIMEOUT', 24 * 60 * 60))
+
+
+# Популярность рецептов (refresh_popularity): добавление в избранное
+# или список покупок весит 2 ** ((время добавления - ориентир)
+# / POPULARITY_HALF_LIFE_DAYS), то есть вклад добавления вдвое меньше
+# вклада такого же добавления на период позже. Ориентир хранится
+# в recipes.PopularityLandmark; когда от него проходит больше
+# POPULARITY_REBASE_HALF_LIVES периодов (float переполняется после
+# 1024), refresh_popularity сдвигает его и пересчитывает суммы.
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv('POPULARITY_HALF_LIFE_DAYS', 7))
+POPULARITY_REBASE_HALF_LIVES = int(
+    os.getenv('POPULARITY_REBASE_HALF_LIVES', 256)
+)
+
+
+# Картинки рецептов: предельная сторона загружаемой картинки, пиксели,
+# и число потоков, строящих уменьшенные копии (0 - сразу в запросе).
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 6000))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -139,6 +202,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static_back')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузка картинок рецептов через multipart (api.views.ImageUploadView):
+# каталог временных файлов загрузок - вне MEDIA_ROOT, чтобы nginx
+# не отдавал недописанные файлы, хранилище переносит в MEDIA_ROOT
+# готовый; предельный размер файла, байты (больший бросается при
+# приеме); через сколько часов неиспользованная загрузка удаляется
+# (delete_stale_uploads).
+FILE_UPLOAD_TEMP_DIR = os.getenv(
+    'FILE_UPLOAD_TEMP_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram-uploads')
+)
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 2 ** 20))
+IMAGE_UPLOAD_TTL = int(os.getenv('IMAGE_UPLOAD_TTL', 24))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
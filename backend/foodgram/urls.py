@@ -1,9 +1,12 @@
+from api.middleware import metrics_view
 from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    # Не проксируется nginx: доступен только внутри сети контейнеров.
+    path('metrics/', metrics_view),
     #path('api/', include('djoser.urls')),
     #path('api/auth/', include('djoser.urls.authtoken')),
 ]
@@ -3,6 +3,8 @@ from users.models import Follow
 
 from .models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
                      ShoppingCart, Tag)
+from .utils import (get_cart_users, rebuild_cart_totals,
+                    update_search_vectors)
 
 
 class IngredientsInRecipeAdmin(admin.TabularInline):
@@ -39,14 +41,31 @@ class TagsAdmin(admin.ModelAdmin):
     )
 
 
-#class RecipeAdmin(admin.ModelAdmin):
-#    inlines = (IngredientsInRecipeAdmin,)
-#    empty_value_display = ('пусто')
+class RecipeAdmin(admin.ModelAdmin):
+    inlines = (IngredientsInRecipeAdmin,)
+    list_display = (
+        'name',
+        'author',
+        'favorites_count',
+        'shopping_cart_count',
+    )
+    list_select_related = ('author',)
+    readonly_fields = (
+        'favorites_count',
+        'shopping_cart_count',
+    )
+    empty_value_display = ('пусто')
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_vectors(Recipe.objects.filter(pk=form.instance.pk))
+        if change:
+            rebuild_cart_totals(get_cart_users(form.instance.pk))
 
 
 admin.site.register(Ingredient, IngredientsAdmin)
 admin.site.register(Tag, TagsAdmin)
-admin.site.register(Recipe)
+admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Favorite)
 admin.site.register(Follow)
 admin.site.register(ShoppingCart)
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from PIL import Image, ImageOps, features
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Уменьшенные копии картинки рецепта: вписываются в (ширина, высота).
+VARIANTS = {
+    'thumbnail': (160, 120),
+    'card': (480, 360),
+    'detail': (1200, 900),
+}
+VARIANTS_DIR = 'static_back/recipes/variants/'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def get_variant_format():
+    return 'webp' if features.check('webp') else 'jpg'
+
+
+def variant_name(image_name, variant, extension):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{VARIANTS_DIR}{stem}_{variant}.{extension}'
+
+
+def variant_urls(recipe):
+    """{вариант: url} или None, пока копии не готовы."""
+    if not recipe.image or not recipe.image_variants:
+        return None
+    storage = get_storage()
+    return {
+        variant: storage.url(variant_name(
+            recipe.image.name, variant, recipe.image_variants
+        ))
+        for variant in VARIANTS
+    }
+
+
+def build_variants(recipe_id, image_name):
+    """
+    Сохраняет уменьшенные копии картинки и отмечает рецепт готовым,
+    если за это время картинку не заменили.
+    """
+    storage = get_storage()
+    extension = get_variant_format()
+    largest = max(VARIANTS.values())
+    with storage.open(image_name, 'rb') as file, Image.open(file) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе.
+        image.draft('RGB', largest)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+        if extension == 'jpg' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+        for variant, size in VARIANTS.items():
+            copy = image.copy()
+            copy.thumbnail(size, Image.LANCZOS)
+            buffer = BytesIO()
+            copy.save(
+                buffer, 'WEBP' if extension == 'webp' else 'JPEG',
+                quality=80
+            )
+            name = variant_name(image_name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=image_name
+    ).update(image_variants=extension)
+    if not updated:
+        # Картинку заменили или рецепт удалили, пока строились копии.
+        delete_variants(image_name)
+    return updated
+
+
+def delete_variants(image_name):
+    """
+    Удаляет уменьшенные копии картинки, если ее больше не использует
+    ни один рецепт.
+    """
+    if Recipe.objects.filter(image=image_name).exists():
+        return
+    storage = get_storage()
+    for variant in VARIANTS:
+        for extension in ('webp', 'jpg'):
+            name = variant_name(image_name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def _build_in_worker(recipe_id, image_name):
+    try:
+        build_variants(recipe_id, image_name)
+    except Exception:
+        logger.exception(
+            'Не удалось построить копии картинки рецепта %s', recipe_id
+        )
+    finally:
+        # У потока пула свое соединение с базой.
+        connection.close()
+
+
+def schedule_variants(recipe_id, image_name):
+    """
+    Ставит построение копий в пул потоков (IMAGE_WORKERS),
+    при IMAGE_WORKERS = 0 строит сразу.
+    """
+    global _executor
+    if not settings.IMAGE_WORKERS:
+        build_variants(recipe_id, image_name)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    _executor.submit(_build_in_worker, recipe_id, image_name)
@@ -1,20 +1,135 @@
 import csv
+import json
+import os
+import time
 
-from django.conf import settings
-from django.core.management import BaseCommand
+from api.cache import invalidate
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient
 
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+        else:
+            yield None
+
+
+def read_json(file):
+    """
+    Потоково читает массив объектов JSON или JSON Lines:
+    в памяти держится только текущий фрагмент файла.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n[,]':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = file.read(CHUNK_SIZE), 0
+            eof = not buffer
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                raise CommandError(f'Некорректный JSON около: '
+                                   f'{buffer[position:position + 50]!r}')
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        position = end
+        if isinstance(item, dict):
+            yield item.get('name'), item.get('measurement_unit')
+        else:
+            yield None
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonl': read_json,
+}
+
 
 class Command(BaseCommand):
-    help = 'Загрузка из csv файла'
-
-    def handle(self, *args, **kwargs):
-        with open(
-            'data/ingredients.csv',
-            'r',
-            encoding='UTF-8'
-        ) as file:
-            for row in csv.reader(file):
-                Ingredient.objects.get_or_create(
-                    name=row[0], measurement_unit=row[1])
-        self.stdout.write(self.style.SUCCESS('Все ингридиенты загружены!'))
+    help = 'Загрузка ингредиентов из csv или json файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='data/ingredients.csv',
+            help='Путь к файлу, по умолчанию data/ingredients.csv'
+        )
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат файла, по умолчанию по расширению'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пачки строк для вставки'
+        )
+
+    def get_rows(self, file, reader):
+        """Очищенные пары (name, measurement_unit), None - брак."""
+        name_length = Ingredient._meta.get_field('name').max_length
+        unit_length = Ingredient._meta.get_field(
+            'measurement_unit'
+        ).max_length
+        for row in reader(file):
+            if row is None:
+                yield None
+                continue
+            name, unit = (str(value or '').strip() for value in row)
+            if (not name or not unit or len(name) > name_length
+                    or len(unit) > unit_length):
+                yield None
+            else:
+                yield name, unit
+
+    def insert(self, batch):
+        # Размер запроса подбирает бэкенд (в SQLite он ограничен).
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in batch),
+            ignore_conflicts=True
+        )
+
+    def handle(self, *args, path, format=None, batch_size, **kwargs):
+        format = format or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        started = time.perf_counter()
+        total = invalid = 0
+        # Повторы внутри пачки отбрасываются здесь, между пачками
+        # и с уже загруженными строками - уникальным ограничением.
+        batch = set()
+        with open(path, 'r', encoding='UTF-8') as file, \
+                transaction.atomic():
+            before = Ingredient.objects.count()
+            for row in self.get_rows(file, READERS[format]):
+                total += 1
+                if row is None:
+                    invalid += 1
+                    continue
+                batch.add(row)
+                if len(batch) >= batch_size:
+                    self.insert(batch)
+                    batch = set()
+            if batch:
+                self.insert(batch)
+            inserted = Ingredient.objects.count() - before
+        invalidate('ingredients')
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты загружены: строк {total}, добавлено {inserted}, '
+            f'пропущено {total - inserted - invalid}, '
+            f'с ошибками {invalid}, '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
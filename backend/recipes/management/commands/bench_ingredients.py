@@ -0,0 +1,35 @@
+import random
+
+from api.indexes import ingredient_index
+from django.core.management import BaseCommand
+from recipes.management.timing import format_summary, measure, summary
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнение автодополнения ингредиентов: ORM и индекс в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, queries, seed, **kwargs):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            self.stdout.write(self.style.WARNING('Нет ингредиентов'))
+            return
+        rnd = random.Random(seed)
+        prefixes = [
+            name[:rnd.randint(1, min(4, len(name)))]
+            for name in rnd.choices(names, k=queries)
+        ]
+        ingredient_index.refresh()
+        for title, search in (
+            ('orm', lambda prefix: list(Ingredient.objects.filter(
+                name__istartswith=prefix
+            ).values('id', 'name', 'measurement_unit'))),
+            ('index', ingredient_index.search),
+        ):
+            queue = iter(prefixes)
+            timings = measure(lambda: search(next(queue)), len(prefixes))
+            self.stdout.write(f'{title}: {format_summary(summary(timings))}')
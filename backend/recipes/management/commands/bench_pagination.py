@@ -0,0 +1,54 @@
+from django.core.management import BaseCommand
+from django.test import Client
+from recipes.management.timing import format_summary, measure, summary
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class Command(BaseCommand):
+    help = 'Время глубокой страницы ленты рецептов: page-number и курсор'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--query', default='',
+            help='Дополнительные параметры фильтра, например tags=breakfast'
+        )
+
+    def cursor_url(self, position, query):
+        paginator = CursorPagination()
+        paginator.base_url = f'/api/recipes/?pagination=cursor&{query}'
+        return paginator.encode_cursor(
+            Cursor(offset=0, reverse=False, position=str(position))
+        )
+
+    def handle(self, *args, page, limit, repeat, query, **kwargs):
+        client = Client(SERVER_NAME='localhost')
+        urls = {
+            'page-number': f'/api/recipes/?page={page}&limit={limit}&{query}',
+            'cursor': f'/api/recipes/?pagination=cursor&limit={limit}&{query}',
+        }
+        if page > 1:
+            # Курсор страницы page - id последнего рецепта страницы page - 1.
+            previous = client.get(
+                f'/api/recipes/?page={page - 1}&limit={limit}&{query}'
+            )
+            if previous.status_code != 200:
+                self.stderr.write(f'Страницы {page - 1} нет')
+                return
+            urls['cursor'] = self.cursor_url(
+                previous.json()['results'][-1]['id'],
+                f'limit={limit}&{query}'
+            )
+        for title, url in urls.items():
+            response = client.get(url)
+            if response.status_code != 200:
+                self.stderr.write(f'{title}: {response.status_code} {url}')
+                continue
+            ids = [item['id'] for item in response.json()['results']]
+            timings = measure(lambda: client.get(url), repeat)
+            self.stdout.write(
+                f'{title}: {format_summary(summary(timings))} '
+                f'ids={ids[0] if ids else None}..{ids[-1] if ids else None}'
+            )
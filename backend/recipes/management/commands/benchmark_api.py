@@ -0,0 +1,176 @@
+import json
+import tracemalloc
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from recipes.management.timing import measure, summary
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон основных запросов API через тестовый клиент: '
+        'число SQL-запросов, перцентили времени и пик памяти'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument(
+            '--save', metavar='PATH',
+            help='Сохранить результаты в JSON как базовую линию'
+        )
+        parser.add_argument(
+            '--baseline', metavar='PATH',
+            help='Сравнить с базовой линией из JSON'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Допустимый рост p50 относительно базовой линии (доля)'
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Завершиться с ошибкой, если есть регрессии'
+        )
+
+    def get_user(self):
+        """Самый нагруженный пользователь: больше всего подписок."""
+        user = User.objects.annotate(
+            follows=Count('follower')
+        ).order_by('-follows', 'pk').first()
+        if user is None:
+            raise CommandError('Нет пользователей: выполните generate_data')
+        return user
+
+    def get_scenarios(self, token):
+        recipe = Recipe.objects.order_by('-pk').first()
+        if recipe is None:
+            raise CommandError('Нет рецептов: выполните generate_data')
+        tag = Tag.objects.values_list('slug', flat=True).first()
+        ingredient = Ingredient.objects.values_list('name', flat=True).first()
+        anonymous = Client(SERVER_NAME='localhost')
+        authorized = Client(
+            SERVER_NAME='localhost', HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        return {
+            'recipes_list_anonymous': (anonymous, '/api/recipes/'),
+            'recipes_list': (authorized, '/api/recipes/'),
+            'recipes_list_filtered': (
+                authorized, f'/api/recipes/?tags={tag}&is_favorited=1'
+            ),
+            'recipes_list_popular': (
+                authorized, '/api/recipes/?ordering=popular'
+            ),
+            'recipes_list_cursor': (
+                authorized, '/api/recipes/?pagination=cursor'
+            ),
+            'recipe_detail': (authorized, f'/api/recipes/{recipe.pk}/'),
+            'recipes_feed': (authorized, '/api/recipes/feed/'),
+            'subscriptions': (
+                authorized, '/api/users/subscriptions/?recipes_limit=3'
+            ),
+            'ingredient_search': (
+                anonymous, f'/api/ingredients/?name={ingredient[:2]}'
+            ),
+            'download_shopping_cart': (
+                authorized, '/api/recipes/download_shopping_cart/'
+            ),
+        }
+
+    def fetch(self, client, url):
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def run_scenario(self, client, url, repeat):
+        response = self.fetch(client, url)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: {response.status_code}')
+        with CaptureQueriesContext(connection) as queries:
+            self.fetch(client, url)
+        query_count = len(queries.captured_queries)
+        tracemalloc.start()
+        self.fetch(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result = {
+            'queries': query_count,
+            'peak_kb': round(peak / 1024, 1),
+        }
+        result.update(
+            (name, round(value, 3)) for name, value in summary(
+                measure(lambda: self.fetch(client, url), repeat)
+            ).items()
+        )
+        return result
+
+    def compare(self, name, result, baseline, tolerance):
+        """Список регрессий сценария относительно базовой линии."""
+        if name not in baseline:
+            return []
+        base = baseline[name]
+        problems = []
+        if result['queries'] > base['queries']:
+            problems.append(
+                f'запросов {base["queries"]} -> {result["queries"]}'
+            )
+        if result['p50'] > base['p50'] * (1 + tolerance):
+            problems.append(f'p50 {base["p50"]} -> {result["p50"]} мс')
+        return problems
+
+    def handle(self, *args, repeat, save, baseline, tolerance,
+               fail_on_regression, **kwargs):
+        if baseline:
+            with open(baseline, encoding='UTF-8') as file:
+                baseline = json.load(file)['scenarios']
+        user = self.get_user()
+        self.stdout.write(
+            f'Рецептов {Recipe.objects.count()}, '
+            f'пользователей {User.objects.count()}, '
+            f'тестовый пользователь {user.email}'
+        )
+        results = {}
+        regressions = {}
+        # Токен, созданный для прогона, после него удаляется.
+        token, created = Token.objects.get_or_create(user=user)
+        try:
+            scenarios = self.get_scenarios(token)
+            for name, (client, url) in scenarios.items():
+                result = results[name] = self.run_scenario(
+                    client, url, repeat
+                )
+                self.stdout.write(
+                    f'{name}: queries={result["queries"]} '
+                    f'p50={result["p50"]:.3f}ms p95={result["p95"]:.3f}ms '
+                    f'max={result["max"]:.3f}ms peak={result["peak_kb"]}KB'
+                )
+                if baseline:
+                    problems = self.compare(
+                        name, result, baseline, tolerance
+                    )
+                    if problems:
+                        regressions[name] = problems
+                        self.stdout.write(self.style.ERROR(
+                            '  регрессия: ' + ', '.join(problems)
+                        ))
+        finally:
+            if created:
+                token.delete()
+        if save:
+            with open(save, 'w', encoding='UTF-8') as file:
+                json.dump({
+                    'recipes': Recipe.objects.count(),
+                    'users': User.objects.count(),
+                    'repeat': repeat,
+                    'scenarios': results,
+                }, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Базовая линия сохранена в {save}')
+        if regressions and fail_on_regression:
+            raise CommandError(f'Регрессии: {", ".join(regressions)}')
+        if baseline and not regressions:
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management import BaseCommand
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Построение уменьшенных копий картинок рецептов, для которых '
+        'их нет (загруженных до появления копий или через bulk_create)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', dest='rebuild',
+            help='Перестроить копии всех рецептов'
+        )
+
+    def handle(self, *args, rebuild=False, **kwargs):
+        started = time.perf_counter()
+        recipes = Recipe.objects.exclude(image='')
+        if not rebuild:
+            recipes = recipes.filter(image_variants='')
+        built = failed = 0
+        for pk, image in recipes.values_list('pk', 'image').iterator():
+            try:
+                build_variants(pk, image)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {pk}: {error}')
+            else:
+                built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Копии построены: {built}, ошибок {failed}, '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
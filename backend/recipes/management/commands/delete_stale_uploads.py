@@ -0,0 +1,43 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+from recipes.models import ImageUpload
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаление картинок, загруженных через multipart и не привязанных '
+        'к рецепту за IMAGE_UPLOAD_TTL часов, и брошенных временных файлов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl', type=int, default=settings.IMAGE_UPLOAD_TTL,
+            help='Возраст загрузки в часах'
+        )
+
+    def handle(self, *args, ttl, **kwargs):
+        deadline = timezone.now() - timedelta(hours=ttl)
+        uploads = ImageUpload.objects.filter(created__lt=deadline)
+        deleted = 0
+        for upload in uploads.iterator():
+            upload.image.delete(save=False)
+            upload.delete()
+            deleted += 1
+        # Файлы прерванных загрузок: обработчик загрузки не успел
+        # их закрыть.
+        temp_files = 0
+        if os.path.isdir(settings.FILE_UPLOAD_TEMP_DIR):
+            cutoff = time.time() - ttl * 3600
+            for entry in os.scandir(settings.FILE_UPLOAD_TEMP_DIR):
+                if (entry.is_file() and '.upload' in entry.name
+                        and entry.stat().st_mtime < cutoff):
+                    os.remove(entry.path)
+                    temp_files += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено загрузок: {deleted}, временных файлов: {temp_files}'
+        ))
@@ -0,0 +1,46 @@
+from django.core.management import BaseCommand
+from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
+                            ShoppingCart)
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    help = 'Планы выполнения горячих запросов (EXPLAIN) для проверки индексов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='EXPLAIN ANALYZE (только PostgreSQL)'
+        )
+
+    def handle(self, *args, analyze=False, **kwargs):
+        user = User.objects.order_by('pk').first()
+        recipe = Recipe.objects.order_by('pk').first()
+        ingredient = Ingredient.objects.order_by('pk').first()
+        if None in (user, recipe, ingredient):
+            self.stdout.write(self.style.WARNING('Нужны данные в базе'))
+            return
+        queries = {
+            'ingredient_name_prefix_idx': Ingredient.objects.filter(
+                name__istartswith=ingredient.name[:2]
+            ),
+            'recipe_author_id_idx': Recipe.objects.filter(
+                author=recipe.author_id
+            ).order_by('-id')[:6],
+            'follow_author_user_idx': Follow.objects.filter(
+                author=user
+            ).values('user_id'),
+            'favorite_recipe_user_idx': Favorite.objects.filter(
+                recipe=recipe
+            ).values('user_id'),
+            'cart_recipe_user_idx': ShoppingCart.objects.filter(
+                recipe=recipe
+            ).values('user_id'),
+            'unique_ingredient_in_recipe': IngredientsInRecipe.objects.filter(
+                recipe=recipe
+            ),
+        }
+        options = {'analyze': True} if analyze else {}
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain(**options))
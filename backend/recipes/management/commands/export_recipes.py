@@ -0,0 +1,104 @@
+import base64
+import json
+import mimetypes
+import time
+
+from django.core.management import BaseCommand
+from django.db.models import Prefetch
+from recipes.models import IngredientsInRecipe, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка рецептов в JSON Lines: одна строка - один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл для выгрузки, "-" - стандартный вывод'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько рецептов читать из базы за раз'
+        )
+        parser.add_argument(
+            '--embed-images', action='store_true',
+            help='Встраивать картинки в base64 вместо пути в хранилище'
+        )
+
+    def get_batches(self, batch_size):
+        """Рецепты пачками по возрастанию pk, без OFFSET."""
+        queryset = Recipe.objects.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients_in_recipe',
+                IngredientsInRecipe.objects.select_related('ingredient')
+            )
+        ).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def get_image(self, image, embed):
+        if not image:
+            return None
+        if not embed:
+            return image.name
+        content_type = mimetypes.guess_type(image.name)[0] or 'image/png'
+        try:
+            with image.open('rb') as file:
+                data = base64.b64encode(file.read()).decode()
+        except OSError:
+            # Файла нет в хранилище - оставляем путь, как без --embed-images.
+            return image.name
+        return f'data:{content_type};base64,{data}'
+
+    def serialize(self, recipe, embed_images):
+        author = recipe.author
+        return {
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': self.get_image(recipe.image, embed_images),
+            'author': {
+                'email': author.email,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+            },
+            'tags': [tag.slug for tag in recipe.tags.all()],
+            'ingredients': [
+                {
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in recipe.ingredients_in_recipe.all()
+            ],
+        }
+
+    def handle(self, *args, path, batch_size, embed_images, **kwargs):
+        started = time.perf_counter()
+        file = self.stdout if path == '-' else open(
+            path, 'w', encoding='UTF-8'
+        )
+        count = 0
+        try:
+            for batch in self.get_batches(batch_size):
+                for recipe in batch:
+                    file.write(json.dumps(
+                        self.serialize(recipe, embed_images),
+                        ensure_ascii=False
+                    ) + '\n')
+                count += len(batch)
+        finally:
+            if file is not self.stdout:
+                file.close()
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {count}, '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
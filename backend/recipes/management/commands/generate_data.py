@@ -0,0 +1,186 @@
+import random
+import time
+import uuid
+
+from api.cache import invalidate
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import (Favorite, Ingredient, IngredientsInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.utils import (rebuild_cart_totals, reconcile_counters,
+                           update_search_vectors)
+from users.models import Follow, User
+
+
+def zipf_weights(count, exponent=1.1):
+    """Веса по закону Ципфа: первые элементы намного популярнее."""
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация тестовых данных: пользователи, рецепты, подписки, '
+        'избранное и списки покупок с неравномерной популярностью'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--authors', type=float, default=0.2,
+            help='Доля пользователей, публикующих рецепты'
+        )
+        parser.add_argument(
+            '--follows', type=float, default=10,
+            help='Среднее число подписок на пользователя'
+        )
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее число избранных рецептов на пользователя'
+        )
+        parser.add_argument(
+            '--carts', type=float, default=5,
+            help='Среднее число рецептов в списке покупок пользователя'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def create_users(self, count):
+        run = uuid.uuid4().hex[:8]
+        password = make_password('benchmark')
+        emails = []
+        for start in range(0, count, self.batch_size):
+            users = [
+                User(
+                    email=f'bench-{run}-{index}@example.com',
+                    username=f'bench-{run}-{index}',
+                    first_name='Тест',
+                    last_name=f'Пользователь {index}',
+                    password=password
+                )
+                for index in range(start, min(count, start + self.batch_size))
+            ]
+            User.objects.bulk_create(users)
+            emails += [user.email for user in users]
+        pks = dict(User.objects.filter(
+            email__startswith=f'bench-{run}-'
+        ).values_list('email', 'pk'))
+        return [pks[email] for email in emails], run
+
+    def create_recipes(self, count, authors, run):
+        rnd = self.random
+        tags = list(Tag.objects.values_list('pk', flat=True))
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        rnd.shuffle(ingredients)
+        author_weights = zipf_weights(len(authors))
+        ingredient_weights = zipf_weights(len(ingredients), 0.8)
+        recipe_ids = []
+        for start in range(0, count, self.batch_size):
+            size = min(count, start + self.batch_size) - start
+            names = [f'Рецепт {run}-{start + index}' for index in range(size)]
+            Recipe.objects.bulk_create(
+                Recipe(
+                    name=name,
+                    text=f'Описание рецепта {name}',
+                    cooking_time=rnd.randint(5, 180),
+                    image='',
+                    author_id=author
+                )
+                for name, author in zip(names, rnd.choices(
+                    authors, author_weights, k=size
+                ))
+            )
+            # Имя уникально: pk находятся и на базах, где bulk_create
+            # их не возвращает (SQLite в Django 2.2).
+            pks = dict(Recipe.objects.filter(
+                name__in=names
+            ).values_list('name', 'pk'))
+            batch = [pks[name] for name in names]
+            links = []
+            rows = []
+            for recipe_id in batch:
+                for tag_id in rnd.sample(tags, rnd.randint(1, len(tags))):
+                    links.append(Recipe.tags.through(
+                        recipe_id=recipe_id, tag_id=tag_id
+                    ))
+                chosen = set(rnd.choices(
+                    ingredients, ingredient_weights,
+                    k=min(15, max(2, round(rnd.gauss(7, 2.5))))
+                ))
+                rows += [
+                    IngredientsInRecipe(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=rnd.randint(1, 500)
+                    )
+                    for ingredient_id in chosen
+                ]
+            Recipe.tags.through.objects.bulk_create(links)
+            IngredientsInRecipe.objects.bulk_create(rows)
+            update_search_vectors(Recipe.objects.filter(pk__in=batch))
+            recipe_ids += batch
+        return recipe_ids
+
+    def create_links(self, model, field, users, targets, mean):
+        """Для каждого пользователя ~Exp(mean) связей с популярными целями."""
+        if not targets:
+            return 0
+        rnd = self.random
+        weights = zipf_weights(len(targets))
+        rows = []
+        created = 0
+        for user_id in users:
+            count = min(len(targets), int(rnd.expovariate(1 / mean)))
+            chosen = set(rnd.choices(targets, weights, k=count))
+            if model is Follow:
+                chosen.discard(user_id)
+            rows += [
+                model(user_id=user_id, **{field: target})
+                for target in chosen
+            ]
+            if len(rows) >= self.batch_size:
+                model.objects.bulk_create(rows)
+                created += len(rows)
+                rows = []
+        model.objects.bulk_create(rows)
+        return created + len(rows)
+
+    def handle(self, *args, users, recipes, authors, follows, favorites,
+               carts, batch_size, seed, **kwargs):
+        if not Tag.objects.exists():
+            raise CommandError('Нет тегов: выполните add_tags')
+        if not Ingredient.objects.exists():
+            raise CommandError('Нет ингредиентов: выполните add_ings')
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        started = time.perf_counter()
+        with transaction.atomic():
+            user_ids, run = self.create_users(users)
+            author_ids = user_ids[:max(1, int(len(user_ids) * authors))]
+            recipe_ids = self.create_recipes(recipes, author_ids, run)
+            # Популярность рецептов не связана с порядком создания.
+            popular = self.random.sample(recipe_ids, len(recipe_ids))
+            counts = {
+                'подписок': self.create_links(
+                    Follow, 'author_id', user_ids, author_ids, follows
+                ),
+                'избранных': self.create_links(
+                    Favorite, 'recipe_id', user_ids, popular, favorites
+                ),
+                'в списках покупок': self.create_links(
+                    ShoppingCart, 'recipe_id', user_ids, popular, carts
+                ),
+            }
+            # bulk_create не отправляет сигналы: суммы списков покупок
+            # пересобираются для созданных пользователей, счетчики
+            # сверяются.
+            rebuild_cart_totals(user_ids)
+            reconcile_counters()
+        invalidate('recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей {len(user_ids)}, '
+            f'рецептов {len(recipe_ids)}, '
+            + ', '.join(f'{name} {count}' for name, count in counts.items())
+            + f', {time.perf_counter() - started:.2f} с'
+        ))
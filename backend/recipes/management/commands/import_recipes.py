@@ -0,0 +1,252 @@
+import base64
+import binascii
+import json
+import mimetypes
+import sys
+import time
+import uuid
+
+from api.cache import invalidate
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from recipes.models import Ingredient, IngredientsInRecipe, Recipe, Tag
+from recipes.utils import reconcile_counters, update_search_vectors
+from users.models import User
+
+NAME_LENGTH = Recipe._meta.get_field('name').max_length
+INGREDIENT_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+
+def get_max_value(model, name):
+    """
+    Наибольшее значение целого поля. SQLite его не проверяет, поэтому
+    граница берется общая, как у PostgreSQL.
+    """
+    field = model._meta.get_field(name)
+    return BaseDatabaseOperations.integer_field_ranges[
+        field.get_internal_type()
+    ][1]
+
+
+COOKING_TIME_MAX = get_max_value(Recipe, 'cooking_time')
+AMOUNT_MAX = get_max_value(IngredientsInRecipe, 'amount')
+
+
+class Command(BaseCommand):
+    help = 'Загрузка рецептов из JSON Lines (см. export_recipes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл для загрузки, "-" - стандартный ввод'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько рецептов вставлять за раз'
+        )
+
+    def parse(self, line):
+        """Проверенный рецепт из строки файла или None - брак."""
+        try:
+            data = json.loads(line)
+            author = data['author']
+            recipe = {
+                'name': str(data['name']).strip(),
+                'text': str(data['text']),
+                'cooking_time': int(data['cooking_time']),
+                'image': data.get('image') or '',
+                'author': {
+                    'email': str(author['email']).strip().lower(),
+                    'username': str(author['username']).strip(),
+                    'first_name': str(author.get('first_name', '')),
+                    'last_name': str(author.get('last_name', '')),
+                },
+                'tags': [str(slug) for slug in data.get('tags', ())],
+                'ingredients': {
+                    (str(item['name']).strip(),
+                     str(item['measurement_unit']).strip()):
+                    int(item['amount'])
+                    for item in data['ingredients']
+                },
+            }
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+        if (not recipe['name'] or len(recipe['name']) > NAME_LENGTH
+                or not 1 <= recipe['cooking_time'] <= COOKING_TIME_MAX
+                or not recipe['ingredients']):
+            return None
+        for amount in recipe['ingredients'].values():
+            if not 1 <= amount <= AMOUNT_MAX:
+                return None
+        for name, unit in recipe['ingredients']:
+            if (not name or not unit or len(name) > INGREDIENT_LENGTH
+                    or len(unit) > UNIT_LENGTH):
+                return None
+        return recipe
+
+    def get_authors(self, batch):
+        """{email: id}; недостающие авторы создаются без пароля."""
+        authors = {
+            recipe['author']['email']: recipe['author'] for recipe in batch
+        }
+        existing = dict(User.objects.filter(
+            email__in=authors
+        ).values_list('email', 'pk'))
+        User.objects.bulk_create(
+            (User(password=make_password(None), **author)
+             for email, author in authors.items() if email not in existing),
+            ignore_conflicts=True
+        )
+        return dict(User.objects.filter(
+            email__in=authors
+        ).values_list('email', 'pk'))
+
+    def get_ingredients(self, batch):
+        """{(name, measurement_unit): id}; недостающие создаются."""
+        keys = {key for recipe in batch for key in recipe['ingredients']}
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in keys),
+            ignore_conflicts=True
+        )
+        return {
+            (name, unit): pk
+            for pk, name, unit in Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('pk', 'name', 'measurement_unit')
+            if (name, unit) in keys
+        }
+
+    def get_image(self, image):
+        """Путь в хранилище как есть, data: URL - сохраняется файлом."""
+        if not image.startswith('data:'):
+            return image
+        header, _, data = image.partition(',')
+        content_type = header[len('data:'):].split(';')[0]
+        extension = mimetypes.guess_extension(content_type) or '.png'
+        field = Recipe._meta.get_field('image')
+        try:
+            content = ContentFile(base64.b64decode(data, validate=True))
+        except binascii.Error:
+            return ''
+        name = field.storage.save(
+            field.generate_filename(None, f'{uuid.uuid4().hex}{extension}'),
+            content
+        )
+        self.saved_images.append(name)
+        return name
+
+    def delete_images(self):
+        """Удаляет картинки, сохраненные в откаченной загрузке."""
+        storage = Recipe._meta.get_field('image').storage
+        for name in self.saved_images:
+            storage.delete(name)
+        self.saved_images = []
+
+    def insert(self, batch, tags):
+        """Вставляет пачку новых рецептов, возвращает их pk."""
+        names = {recipe['name'] for recipe in batch}
+        existing = set(Recipe.objects.filter(
+            name__in=names
+        ).values_list('name', flat=True))
+        batch = list({
+            recipe['name']: recipe for recipe in batch
+            if recipe['name'] not in existing
+        }.values())
+        if not batch:
+            return []
+        authors = self.get_authors(batch)
+        ingredients = self.get_ingredients(batch)
+        batch = [
+            recipe for recipe in batch
+            if recipe['author']['email'] in authors
+        ]
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                name=recipe['name'],
+                text=recipe['text'],
+                cooking_time=recipe['cooking_time'],
+                image=self.get_image(recipe['image']),
+                author_id=authors[recipe['author']['email']]
+            )
+            for recipe in batch
+        )
+        if recipes and recipes[0].pk is None:
+            # SQLite в Django 2.2 не возвращает pk из bulk_create,
+            # имя рецепта уникально - находим их по имени.
+            pks = dict(Recipe.objects.filter(
+                name__in=[recipe.name for recipe in recipes]
+            ).values_list('name', 'pk'))
+            for recipe in recipes:
+                recipe.pk = pks[recipe.name]
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tags[slug])
+            for recipe, data in zip(recipes, batch)
+            for slug in set(data['tags']) if slug in tags
+        )
+        IngredientsInRecipe.objects.bulk_create(
+            IngredientsInRecipe(
+                recipe_id=recipe.pk,
+                ingredient_id=ingredients[key],
+                amount=amount
+            )
+            for recipe, data in zip(recipes, batch)
+            for key, amount in data['ingredients'].items()
+        )
+        return [recipe.pk for recipe in recipes]
+
+    def load(self, batch, tags):
+        # bulk_create не отправляет сигналы: производные данные
+        # (поисковый вектор) пересчитываются здесь же.
+        pks = self.insert(batch, tags)
+        if pks:
+            update_search_vectors(Recipe.objects.filter(pk__in=pks))
+        return len(pks)
+
+    def handle(self, *args, path, batch_size, **kwargs):
+        started = time.perf_counter()
+        tags = dict(Tag.objects.values_list('slug', 'pk'))
+        total = invalid = inserted = 0
+        self.saved_images = []
+        try:
+            file = sys.stdin if path == '-' else open(
+                path, 'r', encoding='UTF-8'
+            )
+        except OSError as error:
+            raise CommandError(error)
+        try:
+            with transaction.atomic():
+                batch = []
+                for line in file:
+                    if not line.strip():
+                        continue
+                    total += 1
+                    recipe = self.parse(line)
+                    if recipe is None:
+                        invalid += 1
+                        continue
+                    batch.append(recipe)
+                    if len(batch) >= batch_size:
+                        inserted += self.load(batch, tags)
+                        batch = []
+                if batch:
+                    inserted += self.load(batch, tags)
+                # bulk_create не отправляет сигналы.
+                reconcile_counters()
+        except BaseException:
+            self.delete_images()
+            raise
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        invalidate('ingredients')
+        invalidate('recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецепты загружены: строк {total}, добавлено {inserted}, '
+            f'пропущено {total - inserted - invalid}, '
+            f'с ошибками {invalid}, '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
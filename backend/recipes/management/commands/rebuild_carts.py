@@ -0,0 +1,48 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.models import ShoppingCartIngredient
+from recipes.utils import compute_cart_totals, rebuild_cart_totals
+
+
+class Command(BaseCommand):
+    help = 'Пересборка или проверка агрегированных списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить сохраненные суммы с пересчитанными'
+        )
+        parser.add_argument(
+            '--user', type=int, nargs='+', dest='user_ids',
+            help='id пользователей, по умолчанию все'
+        )
+
+    def handle(self, *args, verify=False, user_ids=None, **kwargs):
+        if not verify:
+            count = rebuild_cart_totals(user_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'Списки покупок пересобраны, строк: {count}'
+            ))
+            return
+        expected = compute_cart_totals(user_ids)
+        rows = ShoppingCartIngredient.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in rows.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        mismatches = [
+            (key, stored.get(key), expected.get(key))
+            for key in sorted(stored.keys() | expected.keys())
+            if stored.get(key) != expected.get(key)
+        ]
+        for (user_id, ingredient_id), actual, amount in mismatches:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'сохранено {actual}, должно быть {amount}'
+            )
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.utils import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверка счетчиков рецептов, подписчиков, избранного и списков '
+        'покупок с COUNT(*) и исправление расхождений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только показать расхождения, не исправляя их'
+        )
+
+    def handle(self, *args, verify=False, **kwargs):
+        mismatches = reconcile_counters(verify=verify)
+        for counter, count in mismatches.items():
+            self.stdout.write(f'{counter}: расхождений {count}')
+        total = sum(mismatches.values())
+        if verify and total:
+            raise CommandError(f'Расхождений: {total}')
+        if total:
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено расхождений: {total}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
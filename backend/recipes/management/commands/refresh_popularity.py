@@ -0,0 +1,36 @@
+import time
+
+from django.core.management import BaseCommand
+from recipes.utils import refresh_popularity, reset_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        'Учет новых добавлений в избранное и списки покупок '
+        'в популярности рецептов (?ordering=popular)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Повторять с паузой SECONDS секунд до остановки'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересчитать популярность с нуля'
+        )
+
+    def handle(self, *args, batch_size, loop, rebuild, **kwargs):
+        if rebuild:
+            reset_popularity()
+        while True:
+            started = time.perf_counter()
+            scored = refresh_popularity(batch_size)
+            self.stdout.write(
+                f'Учтено добавлений: {scored}, '
+                f'{time.perf_counter() - started:.2f} с'
+            )
+            if not loop:
+                break
+            time.sleep(loop)
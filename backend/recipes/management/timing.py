@@ -0,0 +1,31 @@
+import statistics
+import time
+
+
+def measure(func, repeat):
+    """Вызывает func repeat раз и возвращает время вызовов в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings, percent):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summary(timings):
+    return {
+        'mean': statistics.mean(timings),
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'max': max(timings),
+    }
+
+
+def format_summary(stats):
+    return ' '.join(f'{name}={value:.3f}ms' for name, value in stats.items())
@@ -0,0 +1,59 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_shared_rows(apps, schema_editor):
+    """
+    Общие строки (ингредиент, количество) превращаются в строки
+    конкретного рецепта. Повторы одного ингредиента в рецепте суммируются.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    links = Recipe.ingredients.through.objects.values_list(
+        'recipe_id',
+        'ingredientsinrecipe__ingredient_id',
+        'ingredientsinrecipe__amount'
+    )
+    amounts = {}
+    for recipe_id, ingredient_id, amount in links.iterator():
+        key = (recipe_id, ingredient_id)
+        amounts[key] = amounts.get(key, 0) + amount
+    IngredientsInRecipe.objects.all().delete()
+    IngredientsInRecipe.objects.bulk_create(
+        (
+            IngredientsInRecipe(
+                recipe_id=recipe_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for (recipe_id, ingredient_id), amount in amounts.items()
+        )
+    )
+
+
+def link_per_recipe_rows(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    Link = Recipe.ingredients.through
+    Link.objects.bulk_create(
+        (
+            Link(recipe_id=recipe_id, ingredientsinrecipe_id=pk)
+            for pk, recipe_id in IngredientsInRecipe.objects.values_list(
+                'pk', 'recipe_id'
+            ).iterator()
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredientsinrecipe',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ingredients_in_recipe', to='recipes.Recipe', verbose_name='Рецепт'),
+        ),
+        migrations.RunPython(split_shared_rows, link_per_recipe_rows),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Перед уникальным (name, measurement_unit) сливает дубли ингредиентов
+    в строку с минимальным id, складывая количества в рецептах
+    и агрегированных списках покупок.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientsInRecipe = apps.get_model('recipes', 'IngredientsInRecipe')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient'
+    )
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in groups:
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(pk=group['keep']).values_list('pk', flat=True))
+        for model, owner in ((IngredientsInRecipe, 'recipe_id'),
+                             (ShoppingCartIngredient, 'user_id')):
+            for row in model.objects.filter(ingredient_id__in=duplicates):
+                target = model.objects.filter(
+                    ingredient_id=group['keep'],
+                    **{owner: getattr(row, owner)}
+                ).first()
+                if target is None:
+                    row.ingredient_id = group['keep']
+                    row.save()
+                else:
+                    target.amount += row.amount
+                    target.save()
+                    row.delete()
+        Ingredient.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Пусто, пока копии не построены', max_length=4, verbose_name='Формат уменьшенных копий картинки'),
+        ),
+    ]
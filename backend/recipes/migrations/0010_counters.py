@@ -0,0 +1,47 @@
+# Generated by Django 2.2.19 on 2026-10-18 17:36
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """Заполняет счетчики рецептов и пользователей по текущим данным."""
+    counters = (
+        ('users', 'User', 'recipes_count', 'Recipe', 'author'),
+        ('users', 'User', 'followers_count', 'users.Follow', 'author'),
+        ('recipes', 'Recipe', 'favorites_count', 'Favorite', 'recipe'),
+        ('recipes', 'Recipe', 'shopping_cart_count', 'ShoppingCart',
+         'recipe'),
+    )
+    for app_label, model_name, field, counted_name, link in counters:
+        model = apps.get_model(app_label, model_name)
+        if '.' in counted_name:
+            counted = apps.get_model(counted_name)
+        else:
+            counted = apps.get_model('recipes', counted_name)
+        model.objects.update(**{field: Coalesce(models.Subquery(
+            counted.objects.filter(**{link: models.OuterRef('pk')}).order_by(
+            ).values(link).annotate(count=models.Count('pk')).values('count')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_counters'),
+        ('recipes', '0009_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:02
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+
+def create_landmark(apps, schema_editor):
+    """
+    Ориентир, от которого посчитана текущая популярность (прежде
+    константа POPULARITY_LANDMARK в настройках).
+    """
+    apps.get_model('recipes', 'PopularityLandmark').objects.create(
+        landmark=datetime(2021, 1, 1, tzinfo=timezone.utc)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityLandmark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('landmark', models.DateTimeField(verbose_name='Ориентир')),
+            ],
+            options={
+                'verbose_name': 'Ориентир популярности',
+                'verbose_name_plural': 'Ориентиры популярности',
+            },
+        ),
+        migrations.RunPython(create_landmark, migrations.RunPython.noop),
+    ]
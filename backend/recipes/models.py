@@ -1,3 +1,6 @@
+import uuid
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from users.models import User
 
@@ -16,6 +19,12 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            ),
+        )
 
 
 class Tag(models.Model):
@@ -38,25 +47,6 @@ class Tag(models.Model):
         return self.name
 
 
-class IngredientsInRecipe(models.Model):
-    ingredient = models.ForeignKey(
-        Ingredient,
-        on_delete=models.CASCADE,
-        verbose_name='Ингредиент',
-        related_name='ingredient'
-    )
-    amount = models.PositiveSmallIntegerField(
-        verbose_name='Количество'
-    )
-
-    class Meta:
-        verbose_name = 'Ингредиент в рецепте'
-        verbose_name_plural = 'Ингредиенты в рецептах'
-
-    def __str__(self):
-        return f'{self.ingredient.name} - {self.amount}'
-
-
 class Recipe(models.Model):
     name = models.CharField(
         max_length=150, verbose_name='Название рецепта',
@@ -70,8 +60,10 @@ class Recipe(models.Model):
         upload_to='static_back/recipes/imgs/', blank=True
     )
     ingredients = models.ManyToManyField(
-        IngredientsInRecipe,
-        verbose_name='Список ингредиентов'
+        Ingredient,
+        through='IngredientsInRecipe',
+        verbose_name='Список ингредиентов',
+        related_name='recipes'
     )
     text = models.TextField(max_length=250, verbose_name='Описания рецепта')
     tags = models.ManyToManyField(
@@ -81,13 +73,89 @@ class Recipe(models.Model):
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления'
     )
+    search_vector = SearchVectorField(
+        null=True, editable=False,
+        verbose_name='Поисковый вектор'
+    )
+    image_variants = models.CharField(
+        max_length=4, blank=True, default='', editable=False,
+        verbose_name='Формат уменьшенных копий картинки',
+        help_text='Пусто, пока копии не построены'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном'
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В списках покупок'
+    )
+    popularity = models.FloatField(
+        default=0, editable=False, verbose_name='Популярность',
+        help_text='Пересчитывается командой refresh_popularity'
+    )
 
     def __str__(self):
         return self.name[:72]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Картинка при загрузке: сигнал pre_save по ней видит замену
+        # картинки без повторного чтения строки.
+        loaded = dict(zip(field_names, values))
+        if 'image' in loaded:
+            instance._loaded_image = loaded['image']
+        return instance
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_id_idx'
+            ),
+            models.Index(
+                fields=('-popularity', '-id'),
+                name='recipe_popularity_idx'
+            ),
+        )
+
+
+class IngredientsInRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='ingredients_in_recipe'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='ingredient'
+    )
+    amount = models.PositiveSmallIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в рецепте'
+        verbose_name_plural = 'Ингредиенты в рецептах'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'ingredient'),
+                name='unique_ingredient_in_recipe'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('ingredient', 'recipe'),
+                name='ingredient_recipe_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.ingredient.name} - {self.amount}'
 
 
 class Favorite(models.Model):
@@ -103,6 +171,13 @@ class Favorite(models.Model):
         verbose_name='рецепт',
         related_name='favorite',
     )
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name='Добавлен'
+    )
+    scored = models.BooleanField(
+        default=False, editable=False,
+        verbose_name='Учтен в популярности'
+    )
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -113,6 +188,17 @@ class Favorite(models.Model):
                 name="unique_favorite_recipe"
             )
         ]
+        indexes = (
+            models.Index(
+                fields=('recipe', 'user'),
+                name='favorite_recipe_user_idx'
+            ),
+            models.Index(
+                fields=('id',),
+                name='favorite_unscored_idx',
+                condition=models.Q(scored=False)
+            ),
+        )
 
     def __str__(self):
         return self.recipe.name
@@ -131,6 +217,13 @@ class ShoppingCart(models.Model):
         verbose_name='рецепт',
         related_name='shopping_cart',
     )
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name='Добавлен'
+    )
+    scored = models.BooleanField(
+        default=False, editable=False,
+        verbose_name='Учтен в популярности'
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -141,3 +234,95 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('recipe', 'user'),
+                name='cart_recipe_user_idx'
+            ),
+            models.Index(
+                fields=('id',),
+                name='cart_unscored_idx',
+                condition=models.Q(scored=False)
+            ),
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    """
+    Суммарное количество ингредиента в списке покупок пользователя.
+    Поддерживается инкрементально (recipes.utils.apply_cart_delta).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='shopping_cart_ingredients',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_cart_ingredient'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.ingredient.name} - {self.amount}'
+
+
+class ImageUpload(models.Model):
+    """
+    Картинка, загруженная заранее через multipart. Рецепт ссылается
+    на нее по токену вместо base64 в теле запроса.
+    """
+    token = models.UUIDField(
+        default=uuid.uuid4, unique=True, editable=False,
+        verbose_name='Токен'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='image_uploads',
+    )
+    image = models.ImageField(
+        upload_to='static_back/recipes/imgs/', verbose_name='Картинка'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True, db_index=True, verbose_name='Загружена'
+    )
+
+    class Meta:
+        verbose_name = 'Загруженная картинка'
+        verbose_name_plural = 'Загруженные картинки'
+
+    def __str__(self):
+        return str(self.token)
+
+
+class PopularityLandmark(models.Model):
+    """
+    Ориентир прямого затухания популярности (recipes.utils.popularity_weight),
+    одна строка. refresh_popularity сдвигает его вперед и пересчитывает
+    Recipe.popularity, пока веса далеки от переполнения float.
+    """
+    landmark = models.DateTimeField(verbose_name='Ориентир')
+
+    class Meta:
+        verbose_name = 'Ориентир популярности'
+        verbose_name_plural = 'Ориентиры популярности'
+
+    def __str__(self):
+        return str(self.landmark)
@@ -0,0 +1,105 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from users.models import Follow
+
+from .images import delete_variants, schedule_variants
+from .models import Favorite, Ingredient, Recipe, ShoppingCart
+from .utils import (add_recipe_to_carts, remove_popularity, update_counters,
+                    update_search_vectors)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        add_recipe_to_carts([instance.user_id], instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_cart_totals(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты еще на месте.
+    add_recipe_to_carts([instance.user_id], instance.recipe_id, sign=-1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, **kwargs):
+    update_search_vectors(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Recipe.objects.filter(
+            ingredients_in_recipe__ingredient=instance
+        ))
+
+
+@receiver(pre_save, sender=Recipe)
+def reset_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    if hasattr(instance, '_loaded_image'):
+        old_image = instance._loaded_image
+    else:
+        # Рецепт создан не из базы: прежнюю картинку не знаем.
+        old_image = Recipe.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+    if old_image != instance.image.name:
+        instance.image_variants = ''
+        # Копии прежней картинки удаляются после сохранения.
+        instance._replaced_image = old_image
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_variants(sender, instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(partial(delete_variants, instance.image.name))
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    replaced_image = instance.__dict__.pop('_replaced_image', None)
+    if replaced_image:
+        transaction.on_commit(partial(delete_variants, replaced_image))
+    # Имя файла окончательное только после сохранения.
+    instance._loaded_image = instance.image.name
+    # Файл картинки сохранен, но строить копии можно только
+    # после фиксации: поток пула читает рецепт своим соединением.
+    if not raw and instance.image and not instance.image_variants:
+        transaction.on_commit(partial(
+            schedule_variants, instance.pk, instance.image.name
+        ))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def increment_counters(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_counters(instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def decrement_counters(sender, instance, **kwargs):
+    update_counters(instance, -1)
+
+
+@receiver(pre_delete, sender=Favorite)
+@receiver(pre_delete, sender=ShoppingCart)
+def subtract_popularity(sender, instance, **kwargs):
+    # Строка блокируется до конца удаления при любой пометке: иначе
+    # refresh_popularity успеет учесть еще не учтенную строку, и ее вес
+    # останется в популярности. Вес вычитается, только если был прибавлен.
+    scored = sender.objects.select_for_update().filter(
+        pk=instance.pk
+    ).values_list('scored', flat=True).first()
+    if scored:
+        remove_popularity(instance.recipe_id, instance.created)
@@ -0,0 +1,368 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import pre_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from users.models import Follow, User
+
+from .images import VARIANTS_DIR
+from .models import (Favorite, Ingredient, PopularityLandmark, Recipe,
+                     ShoppingCart, ShoppingCartIngredient)
+from .utils import (apply_cart_delta, get_popularity_landmark,
+                    refresh_popularity)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN только PostgreSQL')
+class HotLookupIndexesTest(TransactionTestCase):
+    """
+    Горячие запросы используют индексы из миграций recipes.0006
+    и users.0002 (те же запросы, что в команде explain_queries)
+    и ограничение unique_ingredient.
+    """
+
+    # Таблицы такого размера, чтобы планировщик с настройками
+    # по умолчанию предпочел индекс последовательному чтению.
+    USERS = 2000
+    RECIPES = 20000
+    PER_USER = 10
+
+    def setUp(self):
+        users = User.objects.bulk_create(
+            User(
+                username=f'user{index}', email=f'user{index}@example.com',
+                first_name='Имя', last_name=str(index)
+            )
+            for index in range(self.USERS)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index:05}', measurement_unit='г')
+            for index in range(self.RECIPES)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=users[index % len(users)], name=f'Рецепт {index}',
+                text='Описание', cooking_time=5, image=''
+            )
+            for index in range(self.RECIPES)
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(
+                    user=user,
+                    recipe=recipes[(index * self.PER_USER + shift) * 7
+                                   % len(recipes)]
+                )
+                for index, user in enumerate(users)
+                for shift in range(self.PER_USER)
+            )
+        Follow.objects.bulk_create(
+            Follow(user=user, author=users[(index + shift) % len(users)])
+            for index, user in enumerate(users)
+            for shift in range(1, self.PER_USER + 1)
+        )
+        self.user = users[0]
+        self.recipe = recipes[0]
+        # Тест не обернут в транзакцию: VACUUM заполняет карту видимости,
+        # без нее index-only scan для планировщика не дешевле обычного.
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM ANALYZE')
+
+    def test_hot_lookups(self):
+        lookups = (
+            (
+                Ingredient.objects.filter(
+                    name__istartswith='ингредиент 001'
+                ),
+                'ingredient_name_prefix_idx'
+            ),
+            (
+                Ingredient.objects.filter(
+                    name='Ингредиент 00007', measurement_unit='г'
+                ),
+                'unique_ingredient'
+            ),
+            (
+                Recipe.objects.filter(author=self.user).order_by('-id')[:6],
+                'recipe_author_id_idx'
+            ),
+            (
+                Follow.objects.filter(author=self.user).values('user_id'),
+                'follow_author_user_idx'
+            ),
+            (
+                Favorite.objects.filter(recipe=self.recipe).values(
+                    'user_id'
+                ),
+                'favorite_recipe_user_idx'
+            ),
+            (
+                ShoppingCart.objects.filter(recipe=self.recipe).values(
+                    'user_id'
+                ),
+                'cart_recipe_user_idx'
+            ),
+        )
+        for queryset, index in lookups:
+            with self.subTest(index=index):
+                plan = queryset.explain()
+                self.assertIn(index, plan, plan)
+
+
+class CartDeltaTest(TestCase):
+    """apply_cart_delta не уводит разошедшуюся строку ниже нуля."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+
+    def get_amounts(self):
+        return list(ShoppingCartIngredient.objects.filter(
+            user=self.user
+        ).values_list('amount', flat=True))
+
+    def test_add_and_subtract(self):
+        apply_cart_delta([self.user.pk], {self.ingredient.pk: 5})
+        apply_cart_delta([self.user.pk], {self.ingredient.pk: -2})
+        self.assertEqual(self.get_amounts(), [3])
+        apply_cart_delta([self.user.pk], {self.ingredient.pk: -3})
+        self.assertEqual(self.get_amounts(), [])
+
+    def test_subtract_more_than_stored(self):
+        ShoppingCartIngredient.objects.create(
+            user=self.user, ingredient=self.ingredient, amount=3
+        )
+        apply_cart_delta([self.user.pk], {self.ingredient.pk: -5})
+        self.assertEqual(self.get_amounts(), [])
+
+
+class PopularityTest(TestCase):
+    """Удаление из избранного вычитает вес, только если он был учтен."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Описание',
+            cooking_time=5, image=''
+        )
+
+    def get_popularity(self):
+        return Recipe.objects.get(pk=self.recipe.pk).popularity
+
+    def test_delete_scored(self):
+        favorite = Favorite.objects.create(user=self.user, recipe=self.recipe)
+        refresh_popularity()
+        self.assertGreater(self.get_popularity(), 0)
+        favorite.delete()
+        self.assertAlmostEqual(self.get_popularity(), 0)
+
+    def test_delete_unscored(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe).delete()
+        self.assertEqual(self.get_popularity(), 0)
+        self.assertEqual(refresh_popularity(), 0)
+
+    def test_rebase(self):
+        landmark = get_popularity_landmark()
+        old_landmark = timezone.now() - 10 * timedelta(
+            days=settings.POPULARITY_HALF_LIFE_DAYS
+        )
+        PopularityLandmark.objects.update(landmark=old_landmark)
+        favorite = Favorite.objects.create(user=self.user, recipe=self.recipe)
+        refresh_popularity()
+        self.assertAlmostEqual(self.get_popularity() / 2 ** 10, 1, 3)
+        with override_settings(POPULARITY_REBASE_HALF_LIVES=5):
+            refresh_popularity()
+        self.assertGreater(get_popularity_landmark(), landmark)
+        self.assertAlmostEqual(self.get_popularity(), 1, 3)
+        favorite.delete()
+        self.assertAlmostEqual(self.get_popularity(), 0)
+
+
+@skipUnless(
+    connection.vendor == 'postgresql', 'SKIP LOCKED только PostgreSQL'
+)
+class PopularityRaceTest(TransactionTestCase):
+    """
+    refresh_popularity не учитывает строку, которую в это время удаляют:
+    иначе ее вес останется в популярности удаленной строки.
+    """
+
+    def setUp(self):
+        user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Проверка'
+        )
+        self.recipe = Recipe.objects.create(
+            author=user, name='Рецепт', text='Описание',
+            cooking_time=5, image=''
+        )
+        self.favorite = Favorite.objects.create(user=user, recipe=self.recipe)
+
+    def test_refresh_during_delete(self):
+        paused, resume = threading.Event(), threading.Event()
+
+        def pause(sender, **kwargs):
+            paused.set()
+            resume.wait(5)
+
+        def delete():
+            try:
+                self.favorite.delete()
+            finally:
+                connection.close()
+
+        # Подключен позже subtract_popularity: удаление останавливается
+        # после него, но до DELETE.
+        pre_delete.connect(pause, sender=Favorite)
+        self.addCleanup(pre_delete.disconnect, pause, sender=Favorite)
+        thread = threading.Thread(target=delete)
+        thread.start()
+        self.assertTrue(paused.wait(5))
+        try:
+            self.assertEqual(refresh_popularity(), 0)
+        finally:
+            resume.set()
+            thread.join()
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).popularity, 0
+        )
+
+
+class ImportRecipesTest(TestCase):
+    """Брак в строке пропускается, откат загрузки не оставляет картинок."""
+
+    IMAGE = (
+        'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+        'AAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+    )
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root
+
+    def write(self, *recipes):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix='.jsonl', encoding='UTF-8', delete=False
+        )
+        self.addCleanup(os.remove, file.name)
+        with file:
+            for recipe in recipes:
+                file.write(json.dumps(recipe, ensure_ascii=False) + '\n')
+        return file.name
+
+    def recipe(self, name, amount=10, cooking_time=5):
+        return {
+            'name': name, 'text': 'Описание', 'cooking_time': cooking_time,
+            'image': self.IMAGE,
+            'author': {'email': 'author@example.com', 'username': 'author'},
+            'ingredients': [
+                {'name': 'Соль', 'measurement_unit': 'г', 'amount': amount}
+            ],
+        }
+
+    def saved_images(self):
+        return [
+            name for _, _, names in os.walk(self.media_root) for name in names
+        ]
+
+    def test_out_of_range_values_are_skipped(self):
+        path = self.write(
+            self.recipe('Рецепт'),
+            self.recipe('Много соли', amount=40000),
+            self.recipe('Долго', cooking_time=40000),
+        )
+        call_command('import_recipes', path, stdout=StringIO())
+        self.assertEqual(
+            list(Recipe.objects.values_list('name', flat=True)), ['Рецепт']
+        )
+
+    def test_rollback_deletes_images(self):
+        path = self.write(self.recipe('Рецепт'))
+        with mock.patch(
+            'recipes.management.commands.import_recipes.reconcile_counters',
+            side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            call_command('import_recipes', path)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(self.saved_images(), [])
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageVariantsTest(TransactionTestCase):
+    """Копии прежней картинки удаляются при замене и удалении рецепта."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.variants_dir = os.path.join(media_root, VARIANTS_DIR)
+        self.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Проверка'
+        )
+
+    def image(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), 'green').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), 'image/png')
+
+    def variants(self):
+        if not os.path.isdir(self.variants_dir):
+            return set()
+        return set(os.listdir(self.variants_dir))
+
+    def test_variants_follow_image(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=5, image=self.image('first.png')
+        )
+        first = self.variants()
+        self.assertEqual(len(first), 3)
+
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        recipe.name = 'Другое название'
+        with CaptureQueriesContext(connection) as queries:
+            recipe.save()
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT "recipes_recipe"."image"')
+            for query in queries.captured_queries
+        ))
+        self.assertEqual(self.variants(), first)
+
+        recipe.image = self.image('second.png')
+        recipe.save()
+        second = self.variants()
+        self.assertEqual(len(second), 3)
+        self.assertFalse(first & second)
+
+        recipe.delete()
+        self.assertEqual(self.variants(), set())
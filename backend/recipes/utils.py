@@ -0,0 +1,321 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import connection, transaction
+from django.db.models import (Case, Count, F, FloatField, OuterRef, Subquery,
+                              Sum, Value, When)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from users.models import Follow, User
+
+from .models import (Favorite, IngredientsInRecipe, PopularityLandmark,
+                     Recipe, ShoppingCart, ShoppingCartIngredient)
+
+# (модель, поле счетчика, считаемая модель, ее внешний ключ на модель).
+COUNTERS = (
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+)
+
+# Что учитывается в Recipe.popularity.
+POPULARITY_SOURCES = (Favorite, ShoppingCart)
+# Рецептов в одном UPDATE ... CASE: по два параметра на рецепт.
+POPULARITY_CASE_SIZE = 400
+
+
+def get_recipe_amounts(recipe_ids):
+    """Возвращает {ingredient_id: количество} для набора рецептов."""
+    return dict(
+        IngredientsInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(Sum('amount')).order_by()
+    )
+
+
+def apply_cart_delta(user_ids, delta):
+    """
+    Изменяет агрегированные списки покупок пользователей user_ids
+    на delta = {ingredient_id: изменение количества}.
+    Недостающие строки вставляются с нулем (ON CONFLICT DO NOTHING),
+    затем все меняются через F(): параллельные изменения тех же строк
+    ждут друг друга на блокировке строки, а не падают на уникальности.
+    Разошедшаяся с корзиной строка не уходит ниже нуля (Greatest),
+    иначе PositiveIntegerField в PostgreSQL падает на CHECK.
+    Число запросов зависит от числа ингредиентов, но не пользователей.
+    Вызывать в одной транзакции с изменением ShoppingCart.
+    """
+    user_ids = sorted(user_ids)
+    delta = {pk: change for pk, change in sorted(delta.items()) if change}
+    if not user_ids or not delta:
+        return
+    rows = ShoppingCartIngredient.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=delta
+    )
+    with transaction.atomic():
+        ShoppingCartIngredient.objects.bulk_create(
+            (
+                ShoppingCartIngredient(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id, change in delta.items()
+                if change > 0
+            ),
+            ignore_conflicts=True
+        )
+        for ingredient_id, change in delta.items():
+            amount = F('amount') + change
+            if change < 0:
+                amount = Greatest(amount, 0)
+            rows.filter(ingredient_id=ingredient_id).update(amount=amount)
+        rows.filter(amount=0).delete()
+
+
+def add_recipe_to_carts(user_ids, recipe_id, sign=1):
+    """Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецепта."""
+    amounts = get_recipe_amounts([recipe_id])
+    apply_cart_delta(
+        user_ids,
+        {pk: sign * amount for pk, amount in amounts.items()}
+    )
+
+
+def get_cart_users(recipe_id):
+    return list(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True)
+    )
+
+
+def compute_cart_totals(user_ids=None):
+    """Считает списки покупок заново по ShoppingCart."""
+    if user_ids is None:
+        rows = IngredientsInRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False
+        )
+    else:
+        rows = IngredientsInRecipe.objects.filter(
+            recipe__shopping_cart__user_id__in=user_ids
+        )
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in rows.values_list(
+            'recipe__shopping_cart__user_id', 'ingredient_id'
+        ).annotate(
+            total=Sum('amount')
+        ).order_by()
+    }
+
+
+def rebuild_cart_totals(user_ids=None):
+    """Пересобирает агрегированные списки покупок с нуля."""
+    totals = compute_cart_totals(user_ids)
+    rows = ShoppingCartIngredient.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    with transaction.atomic():
+        rows.delete()
+        ShoppingCartIngredient.objects.bulk_create(
+            (
+                ShoppingCartIngredient(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for (user_id, ingredient_id), amount in totals.items()
+            )
+        )
+    return len(totals)
+
+
+def update_search_vectors(recipes):
+    """
+    Пересчитывает search_vector: название (вес A), описание (B)
+    и имена ингредиентов (C). recipes - выборка рецептов.
+    На других базах поиск работает без вектора, см. RecipeFilter.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.aggregates import StringAgg
+
+    ingredient_names = IngredientsInRecipe.objects.filter(
+        recipe=OuterRef('pk')
+    ).values('recipe').annotate(
+        names=StringAgg('ingredient__name', ' ')
+    ).values('names')
+    config = settings.SEARCH_CONFIG
+    recipes.update(search_vector=(
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('text', weight='B', config=config)
+        + SearchVector(Subquery(ingredient_names), weight='C', config=config)
+    ))
+
+
+def update_counters(instance, delta):
+    """
+    Меняет на delta счетчики, в которых учитывается instance,
+    одним UPDATE ... SET count = count + delta на каждый счетчик.
+    Уменьшение не опускает счетчик ниже нуля, расхождение
+    исправит reconcile_counters.
+    """
+    for model, field, counted, link in COUNTERS:
+        if not isinstance(instance, counted):
+            continue
+        rows = model.objects.filter(pk=getattr(instance, f'{link}_id'))
+        if delta < 0:
+            rows = rows.filter(**{f'{field}__gte': -delta})
+        rows.update(**{field: F(field) + delta})
+
+
+def reconcile_counters(verify=False):
+    """
+    Сверяет счетчики COUNTERS с COUNT(*) и, если не verify, исправляет
+    расходящиеся. Возвращает {'модель.поле': число расхождений}.
+    """
+    mismatches = {}
+    for model, field, counted, link in COUNTERS:
+        actual = Coalesce(Subquery(
+            counted.objects.filter(**{link: OuterRef('pk')}).order_by(
+            ).values(link).annotate(count=Count('pk')).values('count')
+        ), 0)
+        stale = model.objects.annotate(actual=actual).exclude(
+            **{field: F('actual')}
+        )
+        count = stale.count()
+        if count and not verify:
+            model.objects.filter(
+                pk__in=stale.values('pk')
+            ).update(**{field: actual})
+        mismatches[f'{model._meta.model_name}.{field}'] = count
+    return mismatches
+
+
+def get_popularity_landmark(lock=False):
+    """
+    Текущий ориентир популярности; lock=True блокирует его до конца
+    транзакции (пачка refresh_popularity, сдвиг ориентира).
+    """
+    queryset = PopularityLandmark.objects.all()
+    if lock:
+        queryset = queryset.select_for_update()
+    landmark, _ = queryset.get_or_create(
+        pk=1, defaults={'landmark': timezone.now()}
+    )
+    return landmark.landmark
+
+
+def popularity_half_lives(created, landmark):
+    """Сколько периодов POPULARITY_HALF_LIFE_DAYS прошло от landmark."""
+    return (created - landmark).total_seconds() / (
+        settings.POPULARITY_HALF_LIFE_DAYS * 24 * 3600
+    )
+
+
+def popularity_weight(created, landmark):
+    """
+    Вес добавления с прямым затуханием (forward decay): растет
+    со временем добавления, а не падает со временем запроса, поэтому
+    сохраненные суммы не пересчитываются, а порядок рецептов по ним
+    совпадает с порядком по затухающему счету.
+    """
+    return 2 ** popularity_half_lives(created, landmark)
+
+
+def remove_popularity(recipe_id, created):
+    """Вычитает из популярности рецепта вес учтенного добавления."""
+    # Строка рецепта блокируется до чтения ориентира: rebase_popularity
+    # пересчитывает рецепты под теми же блокировками, поэтому вес и сумма
+    # всегда посчитаны от одного ориентира.
+    Recipe.objects.select_for_update().filter(pk=recipe_id).exists()
+    weight = popularity_weight(created, get_popularity_landmark())
+    Recipe.objects.filter(pk=recipe_id).update(
+        popularity=F('popularity') - weight
+    )
+
+
+def rebase_popularity():
+    """
+    Если от ориентира прошло больше POPULARITY_REBASE_HALF_LIVES
+    периодов, сдвигает его к текущему времени и делит Recipe.popularity
+    на 2 ** (сдвиг в периодах): порядок рецептов не меняется, а веса
+    новых добавлений не доходят до переполнения float.
+    Возвращает True, если ориентир сдвинут.
+    """
+    with transaction.atomic():
+        landmark = get_popularity_landmark(lock=True)
+        now = timezone.now()
+        half_lives = popularity_half_lives(now, landmark)
+        if half_lives <= settings.POPULARITY_REBASE_HALF_LIVES:
+            return False
+        Recipe.objects.exclude(popularity=0).update(
+            popularity=F('popularity') * 2 ** -half_lives
+        )
+        PopularityLandmark.objects.update(landmark=now)
+    return True
+
+
+def add_popularity(deltas):
+    """
+    Прибавляет к популярности рецептов deltas = {recipe_id: вес}
+    одним UPDATE ... CASE на POPULARITY_CASE_SIZE рецептов.
+    """
+    deltas = list(deltas.items())
+    for start in range(0, len(deltas), POPULARITY_CASE_SIZE):
+        chunk = deltas[start:start + POPULARITY_CASE_SIZE]
+        Recipe.objects.filter(
+            pk__in=[recipe_id for recipe_id, _ in chunk]
+        ).update(popularity=F('popularity') + Case(
+            *(When(pk=recipe_id, then=Value(delta))
+              for recipe_id, delta in chunk),
+            output_field=FloatField()
+        ))
+
+
+def refresh_popularity(batch_size=1000):
+    """
+    Добавляет к Recipe.popularity веса еще не учтенных (scored=False)
+    строк избранного и списков покупок пачками по batch_size: на пачку
+    один SELECT, UPDATE рецептов по add_popularity и UPDATE пометки.
+    Перед пересчетом при необходимости сдвигает ориентир
+    (rebase_popularity). Возвращает число учтенных строк.
+    """
+    rebase_popularity()
+    scored = 0
+    for model in POPULARITY_SOURCES:
+        while True:
+            with transaction.atomic():
+                landmark = get_popularity_landmark(lock=True)
+                rows = list(model.objects.select_for_update(
+                    skip_locked=True
+                ).filter(scored=False).order_by('pk').values_list(
+                    'pk', 'recipe_id', 'created'
+                )[:batch_size])
+                if not rows:
+                    break
+                deltas = defaultdict(float)
+                for _, recipe_id, created in rows:
+                    deltas[recipe_id] += popularity_weight(
+                        created, landmark
+                    )
+                add_popularity(deltas)
+                model.objects.filter(
+                    pk__in=[pk for pk, _, _ in rows]
+                ).update(scored=True)
+            scored += len(rows)
+    return scored
+
+
+def reset_popularity():
+    """
+    Обнуляет популярность и переносит ориентир на текущее время:
+    refresh_popularity посчитает ее заново.
+    """
+    with transaction.atomic():
+        get_popularity_landmark(lock=True)
+        PopularityLandmark.objects.update(landmark=timezone.now())
+        Recipe.objects.exclude(popularity=0).update(popularity=0)
+        for model in POPULARITY_SOURCES:
+            model.objects.filter(scored=True).update(scored=False)
@@ -10,6 +10,12 @@ class UserAdmin(admin.ModelAdmin):
         'email',
         'last_name',
         'first_name',
+        'recipes_count',
+        'followers_count',
+    )
+    readonly_fields = (
+        'recipes_count',
+        'followers_count',
     )
     list_filter = (
         'email',
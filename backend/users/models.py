@@ -26,6 +26,14 @@ class User(AbstractUser):
         unique=True,
         verbose_name='Электронная почта',
     )
+    # Счетчики поддерживаются сигналами (recipes.signals),
+    # сверяются командой reconcile_counters.
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Число рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Число подписчиков'
+    )
     REQUIRED_FIELDS = ['password', 'username']
     USERNAME_FIELD = 'email'
 
@@ -59,3 +67,9 @@ class Follow(models.Model):
                 name='unique_subscription'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'),
+                name='follow_author_user_idx'
+            ),
+        )